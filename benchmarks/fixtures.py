@@ -0,0 +1,83 @@
+import random
+from io import BytesIO
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw
+
+
+IMAGE_SIZE = (1600, 1000)
+IMAGE_VARIANTS = 8
+PROVIDERS = ('strava', 'komoot', 'ridewithgps')
+
+# url -> (content type, body)
+Pages = Dict[str, Tuple[str, bytes]]
+
+
+def make_image(seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new('RGB', IMAGE_SIZE, (rng.randrange(200, 256), rng.randrange(200, 256), rng.randrange(180, 230)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(400):
+        x, y = rng.randrange(IMAGE_SIZE[0]), rng.randrange(IMAGE_SIZE[1])
+        draw.line((x, y, x + rng.randrange(-300, 300), y + rng.randrange(-300, 300)),
+                  fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)), width=rng.randrange(1, 6))
+    track = [(rng.randrange(IMAGE_SIZE[0]), rng.randrange(IMAGE_SIZE[1])) for _ in range(60)]
+    draw.line(track, fill=(252, 76, 2), width=8)
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_images() -> List[bytes]:
+    return [make_image(seed) for seed in range(IMAGE_VARIANTS)]
+
+
+def _filler(size: int) -> str:
+    # stands in for the inline scripts and styles that make up most of a real route page
+    line = 'window.__state__.push({"k":"v","n":1234567890,"s":"lorem ipsum dolor sit amet"});\n'
+    return line * (size // len(line))
+
+
+def route_page(provider: str, i: int, padding: int) -> Tuple[str, str, str]:
+    name = f'Route {i}'
+    km, climb = f'{20 + i % 130}.{i % 10}', 100 + (i * 37) % 2400
+    filler = _filler(padding)
+    if provider == 'strava':
+        route_url, image_url = f'http://www.strava.com/routes/{i}', f'http://cdn.strava.com/maps/{i}.jpg'
+        html = (
+            f'<html><head><meta property="og:image" content="{image_url}">'
+            f'<meta property="og:description" content="{name} is a {km} km Cycling Route. Explore it.">'
+            f'<script>{filler}</script></head><body>'
+            f'<div class="Detail_routeStat__7yEdS">{km} km</div>'
+            f'<div class="Detail_routeStat__7yEdS">{climb} m</div></body></html>'
+        )
+    elif provider == 'komoot':
+        route_url, image_url = f'http://www.komoot.com/tour/{i}', f'http://cdn.komoot.com/maps/{i}.jpg'
+        html = (
+            f'<html><head><meta property="og:title" content="{name} | Bike Ride | Komoot">'
+            f'<meta property="og:description" content="Bike ride. Distance: {km}\xa0km | Uphill: {climb}\xa0m">'
+            f'<meta property="og:image" content="{image_url}">'
+            f'<script>{filler}</script></head><body>'
+            f'<span data-test-id="t_elevation_up_value">{climb}\xa0m</span></body></html>'
+        )
+    elif provider == 'ridewithgps':
+        route_url, image_url = f'http://ridewithgps.com/routes/{i}', f'http://ridewithgps.com/routes/{i}/full.jpg'
+        html = (
+            f'<html><head><meta property="og:title" content="{name}">'
+            f'<meta property="og:description" content="{km} km, +{climb} m. Bike ride in Tbilisi, Georgia">'
+            f'<meta name="twitter:image" content="{image_url}">'
+            f'<script>{filler}</script></head><body></body></html>'
+        )
+    else:
+        raise ValueError(f'Unknown provider {provider}')
+    return route_url, image_url, html
+
+
+def make_routes(count: int, padding: int, images: List[bytes], start: int = 0) -> Tuple[Dict[str, dict], Pages]:
+    route_links, pages = {}, {}
+    for i in range(start, start + count):
+        route_url, image_url, html = route_page(PROVIDERS[i % len(PROVIDERS)], i, padding)
+        route_links[f'Route {i}'] = {'route_url': route_url, 'preview_url': None}
+        pages[route_url] = ('text/html; charset=utf-8', html.encode())
+        pages[image_url] = ('image/jpeg', images[i % len(images)])
+    return route_links, pages
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+import requests
+
+from benchmarks.fixtures import make_images, make_routes
+from benchmarks.standin import StandIn
+from benchmarks.stats import peak_rss_mb, percentile
+
+
+Result = Dict[str, float]
+
+
+def summarize(timings: List[float], elapsed: float, **extra: float) -> Result:
+    return dict(
+        routes=len(timings),
+        elapsed=elapsed,
+        throughput=len(timings) / elapsed if elapsed else 0,
+        p50=percentile(timings, 50) * 1000,
+        p99=percentile(timings, 99) * 1000,
+        peak_rss=peak_rss_mb(),
+        **extra,
+    )
+
+
+def run_ingest(data_dir: str, proxy: str, max_workers: int, render_processes: int) -> Result:
+    os.chdir(data_dir)
+    from announceman import config
+    from announceman.ingest import Ingestor
+    from announceman.loader import load_routes
+    from announceman.preview_cache import FileIdStore
+
+    timings = []
+
+    class TimedIngestor(Ingestor):
+        def load_route(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().load_route(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - started)
+
+    session = requests.Session()
+    session.proxies = {'http': proxy}
+    ingestor = TimedIngestor(max_workers=max_workers, render_processes=render_processes, session=session)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        routes = load_routes(FileIdStore(config.FILE_IDS_PATH), ingestor=ingestor)
+    return summarize(timings, time.perf_counter() - started, loaded=len(routes))
+
+
+def run_render(count: int) -> Result:
+    from announceman.route_preview import add_title_to_image
+
+    images = make_images()
+    timings = []
+    started = time.perf_counter()
+    for i in range(count):
+        image_started = time.perf_counter()
+        add_title_to_image(images[i % len(images)], f'Route {i} | {20 + i % 130} km | {100 + i} m')
+        timings.append(time.perf_counter() - image_started)
+    return summarize(timings, time.perf_counter() - started)
+
+
+def run_parse(count: int, padding: int) -> Result:
+    from announceman.route_preview import get_preview_info, PAGE_CHUNK_SIZE
+
+    route_links, pages = make_routes(count, padding, images=[b''])
+
+    def stream(url: str):
+        body = pages[url][1]
+        for offset in range(0, len(body), PAGE_CHUNK_SIZE):
+            yield body[offset:offset + PAGE_CHUNK_SIZE]
+
+    timings = []
+    started = time.perf_counter()
+    for links in route_links.values():
+        page_started = time.perf_counter()
+        get_preview_info(links['route_url'], stream)
+        timings.append(time.perf_counter() - page_started)
+    return summarize(timings, time.perf_counter() - started)
+
+
+def in_fresh_process(fn: Callable[..., Result], *args) -> Result:
+    # one process per scenario, so peak RSS is not carried over from the previous one
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def print_report(results: Dict[str, Result]):
+    columns = [
+        ('routes', 'routes', 'd'), ('wall s', 'elapsed', '.2f'), ('routes/s', 'throughput', '.1f'),
+        ('p50 ms', 'p50', '.1f'), ('p99 ms', 'p99', '.1f'), ('peak MB', 'peak_rss', '.1f'),
+        ('MB in', 'megabytes', '.2f'), ('requests', 'requests', 'd'),
+    ]
+    print(f'{"scenario":<12}' + ''.join(f'{title:>10}' for title, _, _ in columns))
+    for scenario, result in results.items():
+        result = {'megabytes': result.get('bytes', 0) / 1024 / 1024, 'requests': 0, **result}
+        print(f'{scenario:<12}' + ''.join(f'{result[key]:>10{spec}}' for _, key, spec in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route ingestion against a local stand-in')
+    parser.add_argument('--routes', type=int, default=60, help='routes in the cold ingest')
+    parser.add_argument('--changed', type=float, default=0.1, help='share of routes replaced for the incremental run')
+    parser.add_argument('--latency', type=float, default=50, help='stand-in latency per request, ms')
+    parser.add_argument('--padding', type=int, default=200, help='filler per route page, KB')
+    parser.add_argument('--workers', type=int, default=16, help='ingest threads')
+    parser.add_argument('--render-processes', type=int, default=0, help='processes for rendering previews')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+
+    images = make_images()
+    padding = args.padding * 1024
+    changed = max(1, round(args.routes * args.changed))
+    route_links, pages = make_routes(args.routes, padding, images)
+    new_links, new_pages = make_routes(changed, padding, images, start=args.routes)
+    pages.update(new_pages)
+
+    data_dir = tempfile.mkdtemp(prefix='announceman-bench-')
+    os.makedirs(os.path.join(data_dir, 'announceman_data'))
+    routes_path = os.path.join(data_dir, 'announceman_data', 'routes.json')
+    results = {}
+    try:
+        with StandIn(pages, latency=args.latency / 1000) as standin:
+            def ingest(scenario: str, links: Dict[str, dict]):
+                with open(routes_path, 'w') as f:
+                    json.dump(links, f)
+                requests_before, bytes_before = standin.requests, standin.bytes_sent
+                results[scenario] = in_fresh_process(
+                    run_ingest, data_dir, standin.url, args.workers, args.render_processes,
+                )
+                results[scenario].update(
+                    requests=standin.requests - requests_before, bytes=standin.bytes_sent - bytes_before,
+                )
+
+            ingest('cold', route_links)
+            kept = dict(list(route_links.items())[changed:])
+            ingest('incremental', {**kept, **new_links})
+        results['render'] = in_fresh_process(run_render, args.routes)
+        results['parse'] = in_fresh_process(run_parse, args.routes, padding)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Drive form_router with simulated users')
+    parser.add_argument('--users', type=int, default=2000, help='concurrent announcement flows')
+    parser.add_argument('--routes', type=int, default=200, help='routes in the catalog')
+    parser.add_argument('--latency', type=float, default=0, help='fake Bot API latency, ms')
+    parser.add_argument('--ramp', type=float, default=0, help='spread user arrivals over this many seconds')
+    parser.add_argument('--think', type=float, default=0, help='max pause between user actions, ms')
+    parser.add_argument('--storage', default='memory://', help='STORAGE_URL for conversation state')
+    parser.add_argument('--send-queue', action='store_true', help='apply the Bot API rate limits')
+    parser.add_argument('--burst', action='store_true', help='tap the time picker without waiting for replies')
+    parser.add_argument('--flow', choices=['classic', 'compact'], default='classic', help='FLOW_MODE of the bot')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    # settings are read on import, so the bot modules are imported once the environment is ready
+    from aiogram.methods import SendPhoto
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    from announceman import config
+    from announceman import main as bot_main
+    from announceman.catalog import Catalog, StartPoint
+    from announceman.fake_session import FakeSession
+    from announceman.preview_cache import FileIdStore
+    from announceman.ratelimit import PostRateLimiter
+    from announceman.route import Route
+    from announceman.sender import SendQueue
+    from announceman.storage import create_storage
+    from announceman.uploads import PreviewUploads
+    from benchmarks.stats import percentile, rss_mb
+
+    rng = random.Random(args.seed)
+    routes = [
+        Route(name=f'Route {i}', length=f'{20 + i % 130} km', elevation=f'{100 + i} m', link=f'https://example.com/{i}',
+              preview_message=f'[Route {i}](https://example.com/{i})', preview_image=os.urandom(64 * 1024),
+              cache_key=f'route-{i}', _id=i)
+        for i in range(args.routes)
+    ]
+    start_points = [StartPoint(name=f'Point {i}', link=f'https://example.com/sp/{i}', group=f'Group {i % 3}', _id=i)
+                    for i in range(12)]
+    bot_main.catalog = Catalog(routes, start_points)
+    bot_main.preview_uploads = PreviewUploads(FileIdStore(tempfile.mktemp(suffix='.json')))
+
+    bot_main.storage = create_storage(config.STORAGE_URL)
+    bot_main.post_limiter = PostRateLimiter(bot_main.storage)
+    session = FakeSession(latency=args.latency / 1000)
+    bot = bot_main.bot = bot_main.create_bot(session)
+    if args.send_queue:
+        bot.session.middleware(SendQueue())
+    dp = bot_main.create_dispatcher()
+
+    update_ids = itertools.count(1)
+    latencies: List[float] = []
+    steps: Dict[str, List[float]] = {}
+    halfway = asyncio.Event()
+    at_pace = 0
+    all_at_pace = asyncio.Event()
+
+    async def feed(step: str, update: Update):
+        if args.think:
+            await asyncio.sleep(rng.random() * args.think / 1000)
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+        steps.setdefault(step, []).append(elapsed)
+
+    async def user_flow(user_id: int):
+        nonlocal at_pace
+        user = User(id=user_id, is_bot=False, first_name=f'User {user_id}')
+        chat = Chat(id=user_id, type='private')
+        bot_message = Message(message_id=1, date=datetime.now(), chat=chat, text='...')
+
+        def message(text: str) -> Update:
+            return Update(update_id=next(update_ids),
+                          message=Message(message_id=1, date=datetime.now(), chat=chat, from_user=user, text=text))
+
+        def callback(data: str) -> Update:
+            return Update(update_id=next(update_ids), callback_query=CallbackQuery(
+                id=str(next(update_ids)), from_user=user, chat_instance=str(user_id), data=data, message=bot_message,
+            ))
+
+        route = rng.choice(routes)
+        if args.ramp:
+            await asyncio.sleep(rng.random() * args.ramp)
+        await feed('start', message('/start'))
+        await feed('date', callback(datetime.now(tz=config.TZ).strftime('%B %d')))
+        if args.flow == 'compact':
+            hour = rng.randrange(24)
+            await feed('hour', callback(f'{config.PICKER_HOUR_DATA}{hour}'))
+            await feed('time save', callback(f'{config.PICKER_TIME_DATA}{hour}:{rng.choice([0, 15, 30, 45])}'))
+        else:
+            taps = [feed('time picker', callback(rng.choice(list(bot_main.PICKER_STEPS))))
+                    for _ in range(rng.randrange(1, 6))]
+            if args.burst:
+                await asyncio.gather(*taps)
+            else:
+                for tap in taps:
+                    await tap
+            await feed('time save', callback(config.PICKER_SAVE_DATA))
+        await feed('route page', callback(str(route._id // config.ROUTE_LIST_PAGE_LEN)))
+        await feed('route', callback(f'/route_{route._id}'))
+        start_point, pace = rng.choice(start_points), rng.choice(config.PACES)
+        if args.flow != 'compact':
+            await feed('start point', callback(f'/sp_{start_point._id}'))
+
+        at_pace += 1
+        if at_pace == args.users:
+            all_at_pace.set()
+        await halfway.wait()
+
+        if args.flow == 'compact':
+            await feed('start point and pace', callback(f'/sp_{start_point._id}_{pace}'))
+        else:
+            await feed('pace', callback(pace))
+        await feed('post', callback(config.POST_TO_CHANNEL_DATA))
+
+    gc.collect()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    flows = asyncio.gather(*(user_flow(user_id) for user_id in range(1, args.users + 1)))
+    await all_at_pace.wait()
+    first_half = time.perf_counter() - started
+    gc.collect()
+    rss_at_pace = rss_mb()
+    stored = 0
+    for user_id in range(1, args.users + 1):
+        context = dp.fsm.get_context(bot, chat_id=user_id, user_id=user_id)
+        stored += len(json.dumps([await context.get_state(), await context.get_data()]))
+
+    started = time.perf_counter()
+    halfway.set()
+    await flows
+    elapsed = first_half + time.perf_counter() - started
+
+    calls = session.counts()
+    posted = sum(1 for method in session.requests
+                 if isinstance(method, SendPhoto) and method.chat_id in config.TARGET_CHANNELS)
+    await dp.storage.close()
+    return dict(
+        users=args.users,
+        updates=len(latencies),
+        elapsed=elapsed,
+        updates_per_second=len(latencies) / elapsed,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p90_ms=percentile(latencies, 90) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        max_ms=max(latencies) * 1000,
+        step_p99_ms={step: percentile(values, 99) * 1000 for step, values in steps.items()},
+        kb_per_conversation=(rss_at_pace - rss_before) * 1024 / args.users,
+        stored_bytes_per_conversation=stored / args.users,
+        announcements=posted,
+        api_calls_per_announcement=sum(calls.values()) / posted if posted else 0,
+        api_calls=dict(Counter(calls).most_common()),
+    )
+
+
+def print_report(result: Dict[str, float]):
+    print(f"{result['users']} users, {result['updates']} updates in {result['elapsed']:.2f}s: "
+          f"{result['updates_per_second']:.0f} updates/s")
+    print(f"handler latency ms: p50 {result['p50_ms']:.2f}  p90 {result['p90_ms']:.2f}  "
+          f"p99 {result['p99_ms']:.2f}  max {result['max_ms']:.2f}")
+    print('p99 by step ms: ' + '  '.join(f'{step} {value:.2f}' for step, value in result['step_p99_ms'].items()))
+    print(f"memory per active conversation: {result['kb_per_conversation']:.1f} KB of process RSS "
+          f"(including the simulated clients), {result['stored_bytes_per_conversation']:.0f} bytes of stored state")
+    print(f"{result['announcements']} announcements posted, "
+          f"{result['api_calls_per_announcement']:.1f} API calls per announcement: "
+          + ', '.join(f'{method} {count}' for method, count in result['api_calls'].items()))
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault('BOT_TOKEN', '42:BENCHMARK')
+    os.environ['STORAGE_URL'] = args.storage
+    os.environ['TARGET_CHANNEL_NAME'] = '@benchmark'
+    os.environ['FLOW_MODE'] = args.flow
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
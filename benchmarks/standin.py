@@ -0,0 +1,78 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from benchmarks.fixtures import Pages
+
+
+CHUNK_SIZE = 16 * 1024
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+# local http proxy serving fixture pages in place of the route sites: clients request the
+# real (http://) urls through it, so provider detection by hostname keeps working
+class StandIn:
+    def __init__(self, pages: Pages, latency: float = 0, host: str = '127.0.0.1', port: int = 0):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _handler(self) -> type:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if standin.latency:
+                    time.sleep(standin.latency)
+                content_type, body = standin.pages.get(self.path, ('text/plain', b'not found'))
+                self.send_response(200 if self.path in standin.pages else 404)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                with standin._lock:
+                    standin.requests += 1
+                # count what was actually sent, clients stop reading a page once the fields are found
+                for offset in range(0, len(body), CHUNK_SIZE):
+                    self.wfile.write(body[offset:offset + CHUNK_SIZE])
+                    with standin._lock:
+                        standin.bytes_sent += len(body[offset:offset + CHUNK_SIZE])
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'StandIn':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandIn':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,58 @@
+import json
+from typing import Dict, Iterable, List, Optional
+
+from pydantic.dataclasses import dataclass
+
+from announceman import replies
+from announceman.preview_cache import file_lock, _read_json, _write_atomic
+from announceman.route import Route
+from announceman.search import RouteIndex
+
+
+@dataclass
+class StartPoint:
+    name: str
+    link: str
+    group: str
+    _id: int
+
+    @property
+    def formatted(self) -> str:
+        return f"[{self.name}]({self.link})"
+
+
+# bot processes sharing the data folder assign ids too, so the file is re-read under a lock every time
+class IdRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self.ids: Dict[str, Dict[str, int]] = {}
+
+    def assign(self, kind: str, names: Iterable[str]) -> Dict[str, int]:
+        with file_lock(self.path):
+            self.ids = _read_json(self.path)
+            ids = self.ids.setdefault(kind, {})
+            new_names = sorted(set(names) - set(ids))
+            if new_names:
+                next_id = max(ids.values(), default=-1) + 1
+                for next_id, name in enumerate(new_names, start=next_id):
+                    ids[name] = next_id
+                _write_atomic(self.path, json.dumps(self.ids).encode())
+        return ids
+
+
+class Catalog:
+    def __init__(self, routes: List[Route], start_points: List[StartPoint]):
+        self.routes = routes
+        self.start_points = start_points
+        self.routes_by_id = {route._id: route for route in routes}
+        self.start_points_by_id = {sp._id: sp for sp in start_points}
+        self.index = RouteIndex(routes)
+        self.route_pages = replies.render_route_pages(routes)
+        self.start_points_text = replies.render_starting_points(start_points)
+        self.start_point_grid = replies.render_start_point_grid(start_points)
+
+    def get_route(self, route_id: int) -> Optional[Route]:
+        return self.routes_by_id.get(route_id)
+
+    def get_start_point(self, sp_id: int) -> Optional[StartPoint]:
+        return self.start_points_by_id.get(sp_id)
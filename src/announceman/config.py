@@ -4,17 +4,47 @@ from zoneinfo import ZoneInfo
 from aiogram.types import InlineKeyboardButton
 
 TOKEN = getenv("BOT_TOKEN")
+# alternative Bot API server, e.g. a local stand-in for testing
+BOT_API_URL = getenv("BOT_API_URL") or None
 TZ = ZoneInfo(getenv("TZ", default="Asia/Tbilisi"))
+# telegram user ids allowed to run admin commands
+ADMIN_IDS = {int(user_id) for user_id in getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
 
 # data files and cache
 ROUTES_PATH = "announceman_data/routes.json"
-ROUTES_CACHE = "announceman_data/.routes_loaded.pickle"
+PREVIEW_CACHE_DIR = "announceman_data/.previews"
+# .file_ids.json had file_ids of preview thumbnails, previews are uploaded again once under the new name
+FILE_IDS_PATH = "announceman_data/.preview_file_ids.json"
+IDS_PATH = "announceman_data/.ids.json"
+# previews of removed routes are deleted after this many seconds, other bot processes may still use them
+PREVIEW_ORPHAN_GRACE = float(getenv("PREVIEW_ORPHAN_GRACE", 24 * 3600))
+# check data files for changes every this many seconds, 0 disables
+DATA_RELOAD_INTERVAL = float(getenv("DATA_RELOAD_INTERVAL") or 0)
+# conversation state and post history: sqlite:///<path>, redis://<host>:<port>/<db> or memory://
+STORAGE_URL = getenv("STORAGE_URL", "sqlite:///announceman_data/.storage.sqlite3")
 START_POINTS_PATH = "announceman_data/starting_points.json"
 
+# route ingestion
+INGEST_MAX_WORKERS = int(getenv("INGEST_MAX_WORKERS", 16))
+INGEST_MAX_PER_HOST = int(getenv("INGEST_MAX_PER_HOST", 4))
+INGEST_TIMEOUT = float(getenv("INGEST_TIMEOUT", 30))
+# render previews in a process pool of this size, 0 renders in ingestion threads
+INGEST_RENDER_PROCESSES = int(getenv("INGEST_RENDER_PROCESSES", 0))
+
 # UX config
+# "classic" - arrow time picker, a message per step; "compact" - hour and minute grids, route buttons
+# and start point with pace picked by one tap, for fewer Bot API round-trips per announcement
+FLOW_MODE = getenv("FLOW_MODE") or "classic"
+PACES = ["Easy", "Z2", "FAST"]
 DEFAULT_HOUR = 10
 DEFAULT_MINUTE = 0
 ROUTE_LIST_PAGE_LEN = 10
+FIND_RESULTS_LIMIT = 20
+INLINE_RESULTS_LIMIT = 50
+INLINE_CACHE_TIME = 300
+# Bot API limits of inline keyboards
+KEYBOARD_ROW_LEN = 8
+KEYBOARD_MAX_BUTTONS = 100
 
 # callback data strings
 GO_BACK_DATA = "go-back-data"
@@ -24,6 +54,8 @@ PICKER_DOWN_HOUR_DATA = "picker-down-hour-data"
 PICKER_UP_MINUTE_DATA = "picker-up-minute-data"
 PICKER_DOWN_MINUTE_DATA = "picker-down-minute-data"
 PICKER_SAVE_DATA = "picker-save-data"
+PICKER_HOUR_DATA = "picker-hour-"
+PICKER_TIME_DATA = "picker-time-"
 NO_ACTION_DATA = "no-action-data"
 POST_TO_CHANNEL_DATA = "post-to-channel-data"
 
@@ -36,4 +68,50 @@ KEYBOARD_SERVICE_LINE = [
 
 # channel posting
 TARGET_CHANNEL_NAME = getenv("TARGET_CHANNEL_NAME")
-MIN_TIME_BETWEEN_POSTS = getenv("MIN_TIME_BETWEEN_POSTS", 3600)
+# comma separated channels and groups to post to, @username or numeric chat id
+TARGET_CHANNELS = [
+    int(target) if target.lstrip("-").isdigit() else target
+    for target in map(str.strip, (getenv("TARGET_CHANNEL_NAMES") or TARGET_CHANNEL_NAME or "").split(","))
+    if target
+]
+MIN_TIME_BETWEEN_POSTS = int(getenv("MIN_TIME_BETWEEN_POSTS", 3600))
+MIN_TIME_BETWEEN_CHANNEL_POSTS = int(getenv("MIN_TIME_BETWEEN_CHANNEL_POSTS", 0))
+# how long the same announcement can't be posted again by its author
+DUPLICATE_POST_WINDOW = int(getenv("DUPLICATE_POST_WINDOW", 24 * 3600))
+
+# outbound Bot API limits, messages per second
+SEND_GLOBAL_RATE = float(getenv("SEND_GLOBAL_RATE", 30))
+SEND_PRIVATE_CHAT_RATE = float(getenv("SEND_PRIVATE_CHAT_RATE", 1))
+SEND_GROUP_CHAT_RATE = float(getenv("SEND_GROUP_CHAT_RATE", 20 / 60))
+SEND_CHAT_BURST = float(getenv("SEND_CHAT_BURST", 3))
+# retries of channel posts after network or server errors
+SEND_RETRIES = int(getenv("SEND_RETRIES", 3))
+SEND_RETRY_BACKOFF = float(getenv("SEND_RETRY_BACKOFF", 1))
+SEND_MAX_RETRY_AFTER = int(getenv("SEND_MAX_RETRY_AFTER", 3))
+
+# updates a user can have waiting behind the one being handled, the rest are dropped.
+# Updates of one user are queued per process, several webhook workers don't order them between each other
+USER_QUEUE_LIMIT = int(getenv("USER_QUEUE_LIMIT", 8))
+
+# preview pre-warming
+PREVIEW_STORAGE_CHAT = getenv("PREVIEW_STORAGE_CHAT") or None
+PREWARM_INTERVAL = float(getenv("PREWARM_INTERVAL", 3))
+
+# serving mode: "polling" or "webhook"
+BOT_MODE = getenv("BOT_MODE", "polling")
+# public base url to register the webhook with, unset to leave it to another worker
+WEBHOOK_URL = getenv("WEBHOOK_URL") or None
+WEBHOOK_PATH = getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", 8080))
+# let several worker processes bind the same port, each of them orders updates of a user only by itself
+WEBHOOK_REUSE_PORT = getenv("WEBHOOK_REUSE_PORT", "false").lower() == "true"
+
+# prometheus metrics endpoint, 0 disables
+METRICS_HOST = getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(getenv("METRICS_PORT") or 0)
+# users with an update in a conversation within this many seconds count as active
+METRICS_ACTIVE_WINDOW = float(getenv("METRICS_ACTIVE_WINDOW", 15 * 60))
+# log timing and Bot API calls of every update
+TRACE_UPDATES = (getenv("TRACE_UPDATES") or "false").lower() == "true"
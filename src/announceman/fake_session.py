@@ -0,0 +1,76 @@
+import asyncio
+import itertools
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, SendPhoto, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Chat, Message, PhotoSize, User
+
+
+ErrorFactory = Union[Exception, Callable[[TelegramMethod], Exception]]
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.requests: List[TelegramMethod] = []
+        self.errors: Deque[ErrorFactory] = deque()
+        self._ids = itertools.count(1)
+
+    def fail_next(self, *errors: ErrorFactory):
+        self.errors.extend(errors)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None) -> Any:
+        self.requests.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.errors:
+            error = self.errors.popleft()
+            raise error if isinstance(error, Exception) else error(method)
+        return self.build_result(bot, method)
+
+    def build_result(self, bot: Bot, method: TelegramMethod) -> Any:
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name='Fake', username='fake_bot')
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or 'Message' not in str(method.__returning__):
+            return True
+
+        message_id = next(self._ids)
+        photo = None
+        if isinstance(method, SendPhoto):
+            file_id = method.photo if isinstance(method.photo, str) else f'fake-photo-{message_id}'
+            photo = [PhotoSize(file_id=file_id, file_unique_id=f'unique-{file_id}', width=1280, height=853)]
+        if isinstance(chat_id, str):
+            chat = Chat(id=-message_id, type='channel', username=chat_id.lstrip('@'))
+        else:
+            chat = Chat(id=chat_id, type='private' if chat_id > 0 else 'supergroup')
+        return Message(
+            message_id=getattr(method, 'message_id', None) or message_id,
+            date=datetime.now(),
+            chat=chat,
+            text=getattr(method, 'text', None),
+            caption=getattr(method, 'caption', None),
+            photo=photo,
+        ).as_(bot)
+
+    def count(self, method_type: type) -> int:
+        return sum(isinstance(method, method_type) for method in self.requests)
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for method in self.requests:
+            counts[type(method).__name__] = counts.get(type(method).__name__, 0) + 1
+        return counts
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b''
@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from announceman import config, metrics
+from announceman.route_preview import Route, load_route, add_title_to_image, PAGE_CHUNK_SIZE
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Ingestor:
+    def __init__(
+        self,
+        max_workers: int = config.INGEST_MAX_WORKERS,
+        max_per_host: int = config.INGEST_MAX_PER_HOST,
+        render_processes: int = config.INGEST_RENDER_PROCESSES,
+        session: Optional[requests.Session] = None,
+    ):
+        self.max_workers = max_workers
+        self.render_processes = render_processes
+        self._render_pool: Optional[Executor] = None
+        self._executor: Optional[Executor] = None
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(max_per_host))
+        self._host_slots_lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        with self._host_slots_lock:
+            return self._host_slots[urlparse(url).netloc]
+
+    def fetch(self, url: str) -> bytes:
+        with self._host_slot(url):
+            response = self.session.get(url, timeout=config.INGEST_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f'Failed to fetch {url}: {response.status_code}')
+        return response.content
+
+    def stream(self, url: str) -> Iterator[bytes]:
+        with self._host_slot(url), self.session.get(url, stream=True, timeout=config.INGEST_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise Exception(f'Failed to fetch {url}: {response.status_code}')
+            yield from response.iter_content(PAGE_CHUNK_SIZE)
+
+    def render(self, image_data: bytes, text: str) -> bytes:
+        if self._render_pool is None:
+            return add_title_to_image(image_data, text)
+        return self._render_pool.submit(add_title_to_image, image_data, text).result()
+
+    def load_route(self, route_url: str, route_name: str = None, route_pic: str = None) -> Route:
+        result = 'error'
+        started = time.perf_counter()
+        try:
+            route = load_route(route_url, route_name, route_pic, fetch=self.fetch, stream=self.stream, render=self.render)
+            result = 'ok'
+            return route
+        finally:
+            metrics.INGEST_SECONDS.observe(time.perf_counter() - started, result=result)
+
+    def submit(self, route_url: str, route_name: str = None) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='ingest')
+        return self._executor.submit(self.load_route, route_url, route_name)
+
+    def load_routes(self, route_links: Dict[str, dict]) -> Dict[str, Route]:
+        loaded = {}
+        with ExitStack() as stack:
+            if self.render_processes > 0:
+                # forking a process that already runs the event loop and worker threads can deadlock
+                self._render_pool = stack.enter_context(ProcessPoolExecutor(
+                    self.render_processes, mp_context=multiprocessing.get_context('spawn'),
+                ))
+                stack.callback(setattr, self, '_render_pool', None)
+            executor = stack.enter_context(ThreadPoolExecutor(self.max_workers))
+            futures = {
+                executor.submit(self.load_route, links['route_url'], name, links['preview_url']): name
+                for name, links in route_links.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    loaded[name] = future.result()
+                except Exception:
+                    LOG.exception('Failed to load route %s', name)
+        LOG.info('Loaded %d of %d routes', len(loaded), len(route_links))
+        return loaded
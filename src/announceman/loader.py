@@ -0,0 +1,109 @@
+import json
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from announceman import config, metrics
+from announceman.catalog import Catalog, IdRegistry, StartPoint
+from announceman.preview_cache import PreviewCache, FileIdStore, file_lock, route_key, _write_atomic
+from announceman.route import Route
+
+if TYPE_CHECKING:
+    from announceman.ingest import Ingestor
+
+
+LOG = logging.getLogger(__name__)
+_ingestor: Optional['Ingestor'] = None
+
+
+def get_ingestor() -> 'Ingestor':
+    global _ingestor
+    if _ingestor is None:
+        from announceman.ingest import Ingestor
+        _ingestor = Ingestor()
+    return _ingestor
+
+
+def load_routes(
+    file_ids: FileIdStore,
+    known: Optional[Dict[str, Route]] = None,
+    ingestor: Optional['Ingestor'] = None,
+) -> List[Route]:
+    with open(config.ROUTES_PATH, 'r') as f_route:
+        route_links = json.load(f_route)
+
+    cache = PreviewCache(config.PREVIEW_CACHE_DIR)
+    keys = {name: route_key(links['route_url'], name, links['preview_url']) for name, links in route_links.items()}
+    loaded = {}
+    for name, key in keys.items():
+        route = (known or {}).get(key)
+        if route is None:
+            route = cache.get(key)
+            if route is not None:
+                route.preview_id = file_ids.get(key)
+        if route is not None:
+            loaded[name] = route
+
+    missing = {name: links for name, links in route_links.items() if name not in loaded}
+    LOG.info(f'Routes cache: {len(loaded)} hits, {len(missing)} misses')
+    metrics.PREVIEW_CACHE.inc(len(loaded), result='hit')
+    metrics.PREVIEW_CACHE.inc(len(missing), result='miss')
+    if missing:
+        if ingestor is None:
+            # the scraping and rendering stack is only imported when something has to be fetched
+            from announceman.ingest import Ingestor
+            ingestor = Ingestor()
+        for name, route in ingestor.load_routes(missing).items():
+            cache.put(keys[name], route)
+            loaded[name] = route
+    cache.collect_garbage(keys.values(), config.PREVIEW_ORPHAN_GRACE)
+
+    return list(sorted(loaded.values(), key=lambda r: r.name))
+
+
+def read_route_links() -> Dict[str, dict]:
+    with open(config.ROUTES_PATH, 'r') as f_route:
+        return json.load(f_route)
+
+
+def find_duplicate(route_links: Dict[str, dict], route_url: str, name: Optional[str] = None) -> Optional[str]:
+    for existing_name, links in route_links.items():
+        if links['route_url'].rstrip('/') == route_url.rstrip('/'):
+            return f'already added as {existing_name}'
+    if name is not None and name in route_links:
+        return f'name {name} is already taken'
+    return None
+
+
+# routes that duplicate an existing one by url or name are skipped, ids of existing routes never move.
+# routes.json is re-read under its lock, so routes other bot processes added meanwhile are kept
+def add_routes(routes: Iterable[Tuple[str, Route]]):
+    cache = PreviewCache(config.PREVIEW_CACHE_DIR)
+    with file_lock(config.ROUTES_PATH):
+        route_links = read_route_links()
+        for route_url, route in routes:
+            duplicate = find_duplicate(route_links, route_url, route.name)
+            if duplicate is not None:
+                LOG.warning(f'Not adding route {route_url}: {duplicate}')
+                continue
+            route_links[route.name] = {'route_url': route_url, 'preview_url': None}
+            cache.put(route_key(route_url, route.name, None), route)
+        cache.save()
+        _write_atomic(config.ROUTES_PATH, json.dumps(route_links, indent=2, ensure_ascii=False).encode())
+
+
+def load_starting_points(ids: IdRegistry) -> List[StartPoint]:
+    with open(config.START_POINTS_PATH, 'r') as f_start_points:
+        points = json.load(f_start_points)
+    sp_ids = ids.assign('start_points', points)
+    return [
+        StartPoint(name=name, link=sp['url'], group=sp['group'], _id=sp_ids[name])
+        for name, sp in sorted(points.items(), key=lambda x: x[0])
+    ]
+
+
+def build_catalog(file_ids: FileIdStore, ids: IdRegistry, previous: Optional[Catalog] = None) -> Catalog:
+    routes = load_routes(file_ids, known={route.cache_key: route for route in previous.routes} if previous else None)
+    route_ids = ids.assign('routes', [route.name for route in routes])
+    for route in routes:
+        route._id = route_ids[route.name]
+    return Catalog(routes, load_starting_points(ids))
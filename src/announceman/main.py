@@ -1,50 +1,66 @@
 import asyncio
-import json
 import logging
-import os.path
-import pickle
+import os
 import sys
-from datetime import datetime, timedelta
-from typing import Tuple, List, Union
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.filters import Command, CommandStart
-from aiogram.fsm.context import FSMContext
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
     Message,
     CallbackQuery,
+    InlineQuery,
+    User,
 )
-from pydantic.dataclasses import dataclass
 
-from announceman import replies, config
-from announceman.route_preview import load_route
+from announceman import replies, config, metrics
+from announceman.metrics import ApiMetrics, UpdateMetrics, start_metrics_server
+from announceman.catalog import Catalog, IdRegistry
+from announceman.loader import add_routes, build_catalog, find_duplicate, get_ingestor, read_route_links
+from announceman.ratelimit import PostRateLimiter, fingerprint
+from announceman.scheduler import UpdateScheduler, superseded
+from announceman.sender import SendQueue, send_options
+from announceman.storage import RecordStorage, create_storage
+from announceman.transaction import StateTransaction, TransactionMiddleware
+from announceman.preview_cache import FileIdStore
+from announceman.route import Route
+from announceman.uploads import PreviewUploads
+from announceman.webhook import run_webhook
 
 
 LOG = logging.getLogger(__name__)
-routes = []
-start_points = []
+catalog = Catalog([], [])
+catalog_ids: IdRegistry = None
+catalog_lock = asyncio.Lock()
+background_tasks: Set[asyncio.Task] = set()
+prewarm_task: Optional[asyncio.Task] = None
+preview_uploads: PreviewUploads = None
 form_router = Router()
-latest_posts = {}
-bot = Bot(token=config.TOKEN, default=DefaultBotProperties(
-    parse_mode=ParseMode.MARKDOWN,
-    disable_notification=True,
-    link_preview_is_disabled=True,
-))
-
-
-@dataclass
-class StartPoint:
-    name: str
-    link: str
-    group: str
-    _id: int
-
-    @property
-    def formatted(self) -> str:
-        return f"[{self.name}]({self.link})"
+# created in main(), render processes import this module as well and must not open the storage
+storage: RecordStorage = None
+post_limiter: PostRateLimiter = None
+bot: Bot = None
+
+
+def create_bot(session: Optional[BaseSession] = None) -> Bot:
+    if session is None and config.BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(config.BOT_API_URL))
+    return Bot(
+        token=config.TOKEN,
+        session=session,
+        default=DefaultBotProperties(
+            parse_mode=ParseMode.MARKDOWN,
+            disable_notification=True,
+            link_preview_is_disabled=True,
+        ),
+    )
 
 
 class Form(StatesGroup):
@@ -58,156 +74,297 @@ class Form(StatesGroup):
 
 @form_router.message(Command("cancel"))
 @form_router.message(F.text.casefold() == "cancel")
-async def cancel_handler(message: Message, state: FSMContext) -> None:
-    current_state = await state.get_state()
-    if current_state is None:
+async def cancel_handler(message: Message, tx: StateTransaction) -> None:
+    if tx.state is None:
         return
 
-    logging.info("Cancelling state %r", current_state)
-    await state.clear()
+    logging.info("Cancelling state %r", tx.state)
+    tx.clear()
     await replies.canceled(message)
 
 
 @form_router.message(Command("links"))
 @form_router.message(F.text.casefold() == "links")
-async def links_handler(message: Message, state: FSMContext) -> None:
+async def links_handler(message: Message) -> None:
     LOG.info("Sending links")
     await replies.send_links(
-        routes=[route.preview_message for route in routes],
-        start_points=[sp.formatted for sp in start_points],
+        routes=[route.preview_message for route in catalog.routes],
+        start_points=[sp.formatted for sp in catalog.start_points],
         message=message,
     )
 
 
+@form_router.message(Command("find"))
+async def find_handler(message: Message, command: CommandObject) -> None:
+    routes = catalog.index.find(command.args or '')
+    LOG.info(f'Found {len(routes)} routes for {command.args!r}')
+    await replies.send_found_routes(routes, message)
+
+
+@form_router.message(Command("reload"), F.from_user.id.in_(config.ADMIN_IDS))
+async def reload_handler(message: Message) -> None:
+    await message.reply("Reloading routes and starting points...")
+    try:
+        await message.reply(await reload_catalog())
+    except Exception:
+        LOG.exception("Failed to reload data")
+        await message.reply("Reload failed, keeping the current data. See logs for details")
+
+
+@form_router.message(Command("addroute"), F.from_user.id.in_(config.ADMIN_IDS))
+async def add_route_handler(message: Message, command: CommandObject) -> None:
+    requested = [line.split(maxsplit=1) for line in (command.args or '').splitlines() if line.strip()]
+    if not requested:
+        return await replies.ask_for_route_urls(message)
+
+    # routes of this batch are checked against each other as well
+    route_links = await asyncio.to_thread(read_route_links)
+    statuses = []
+    to_ingest = []
+    batch_urls = set()
+    for i, (route_url, *route_name) in enumerate(requested):
+        duplicate = find_duplicate(route_links, route_url, *route_name)
+        if duplicate is None and route_url.rstrip('/') in batch_urls:
+            duplicate = 'listed twice'
+        if duplicate is None:
+            batch_urls.add(route_url.rstrip('/'))
+            if route_name:
+                route_links[route_name[0]] = {'route_url': route_url, 'preview_url': None}
+            to_ingest.append((i, route_url, *route_name))
+        statuses.append(f'{route_url}: loading' if duplicate is None else f'{route_url}: skipped, {duplicate}')
+    loaded = []
+    progress = await message.reply(replies.format_ingest_progress(statuses, 0), parse_mode=None)
+
+    async def ingest(i: int, route_url: str, route_name: Optional[str] = None):
+        try:
+            route = await asyncio.wrap_future(get_ingestor().submit(route_url, route_name))
+            # scraped names are only known now, urls and given names were checked before ingesting
+            if route_name is None and route.name in route_links:
+                statuses[i] = f'{route_url}: skipped, name {route.name} is already taken'
+            else:
+                route_links[route.name] = {'route_url': route_url, 'preview_url': None}
+                loaded.append((route_url, route))
+                statuses[i] = f'{route_url}: {route.name} | {route.length} | {route.elevation}'
+        except Exception as e:
+            LOG.exception(f'Failed to load route {route_url}')
+            statuses[i] = f'{route_url}: failed ({e})'
+        try:
+            await progress.edit_text(replies.format_ingest_progress(statuses, len(loaded)), parse_mode=None)
+        except Exception:
+            LOG.exception('Failed to update /addroute progress')
+
+    # routes that loaded are added even if something else in the batch failed
+    await asyncio.gather(*(ingest(*args) for args in to_ingest), return_exceptions=True)
+    if not loaded:
+        return
+    try:
+        summary = await reload_catalog(*loaded)
+    except Exception:
+        LOG.exception("Failed to add routes")
+        summary = "Adding routes failed, keeping the current data. See logs for details"
+    await message.reply(summary)
+
+
+@form_router.inline_query()
+async def inline_query_handler(inline_query: InlineQuery) -> None:
+    await replies.answer_inline_routes(catalog.index.find(inline_query.query), inline_query)
+
+
 @form_router.message(Form.track)
-async def process_track(message: Message, state: FSMContext) -> None:
-    await process_track_data(message.text, message, state)
+async def process_track(message: Message, tx: StateTransaction) -> None:
+    await process_track_data(message.text, message, tx)
 
 
 @form_router.message(Form.start_point)
-async def process_start_point(message: Message, state: FSMContext) -> None:
-    await process_start_point_data(message.text, message, state)
+async def process_start_point(message: Message, tx: StateTransaction) -> None:
+    await process_start_point_data(message.text, message, tx)
 
 
 @form_router.message()
 @form_router.message(CommandStart())
-async def command_start(message: Message, state: FSMContext) -> None:
-    await state.clear()
-    await state.set_state(Form.date)
+async def command_start(message: Message, tx: StateTransaction) -> None:
+    await start_form(message, tx)
+
+
+async def start_form(message: Message, tx: StateTransaction) -> None:
+    metrics.start_flow()
+    tx.clear()
+    tx.set_state(Form.date)
     await replies.ask_for_date(message)
 
 
+CallbackHandler = Callable[[CallbackQuery, StateTransaction, str], Awaitable[None]]
+callback_handlers: Dict[Tuple[str, Optional[str]], CallbackHandler] = {}
+
+
+def on_callback(form_state: State, *actions: Optional[str]):
+    def register(handler: CallbackHandler) -> CallbackHandler:
+        for action in actions or (None,):
+            callback_handlers[(form_state.state, action)] = handler
+        return handler
+    return register
+
+
 @form_router.callback_query()
-async def callback_query_handler(callback_query: CallbackQuery, state: FSMContext) -> None:
+async def callback_query_handler(callback_query: CallbackQuery, tx: StateTransaction) -> None:
     callback_data = callback_query.data
-    form_state = await state.get_state()
-    state_data = await state.get_data()
-    stack = state_data.get('stack', [])
-    LOG.info(f'handing callback_data: {callback_data} state: {form_state} stack: {stack}')
-
     if callback_data == config.NO_ACTION_DATA:
         return
 
+    form_state = tx.state
+    LOG.info(f'handing callback_data: {callback_data} state: {form_state} stack: {tx.data.get("stack", [])}')
+
     if callback_data == config.POST_TO_CHANNEL_DATA and str(form_state) != Form.announcement:
         return
 
     if callback_data == config.RESTART_DATA:
-        return await command_start(callback_query.message, state)
+        return await start_form(callback_query.message, tx)
     elif callback_data == config.GO_BACK_DATA:
         try:
-            stack.pop()
-            form_state_name, callback_data = stack.pop()
-            await state.set_state(getattr(Form, form_state_name.split(":")[1]))
+            tx.stack.pop()
+            form_state_name, callback_data = tx.stack.pop()
+            tx.set_state(form_state_name)
         except IndexError:
-            return await command_start(callback_query.message, state)
+            return await start_form(callback_query.message, tx)
     else:
         form_state_name = str(form_state)
 
+    handler = callback_handlers.get((form_state_name, callback_data)) or callback_handlers.get((form_state_name, None))
+    if handler is None:
+        return
+
     if form_state_name not in {Form.track, Form.time, Form.start_point}:
         if not (form_state_name == Form.announcement and callback_data == config.POST_TO_CHANNEL_DATA):
-            stack.append((form_state_name, callback_data))
+            tx.stack.append((form_state_name, callback_data))
+
+    await handler(callback_query, tx, callback_data)
 
-    if form_state_name == Form.date:
-        current_hour = state_data.get('current_hour', config.DEFAULT_HOUR)
-        current_minute = state_data.get('current_minute', config.DEFAULT_MINUTE)
-        await state.update_data(date=callback_data, stack=stack, current_hour=current_hour, current_minute=current_minute)
-        await state.set_state(Form.time)
+
+@on_callback(Form.date)
+async def date_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    current_hour = tx.data.get('current_hour', config.DEFAULT_HOUR)
+    current_minute = tx.data.get('current_minute', config.DEFAULT_MINUTE)
+    tx.update_data(date=callback_data, current_hour=current_hour, current_minute=current_minute)
+    tx.set_state(Form.time)
+    if config.FLOW_MODE == "compact":
+        await replies.ask_for_hour(callback_query.message)
+    else:
         await replies.ask_for_time(
             message=callback_query.message,
             current_hour=current_hour,
             current_minute=current_minute,
         )
-    elif form_state_name == Form.time:
-        current_hour = state_data['current_hour']
-        current_minute = state_data['current_minute']
-        if callback_data == config.PICKER_SAVE_DATA:
-            saved_time = f'{current_hour:02}:{current_minute:02}'
-            stack.append((form_state_name, callback_data))
-            await state.update_data(time=saved_time, stack=stack)
-            await state.set_state(Form.track)
-            return await replies.show_route_list(routes, callback_query.message, page_offset=0)
-        elif callback_data == config.PICKER_UP_HOUR_DATA:
-            current_hour += 1
-            if current_hour == 24:
-                current_hour = 0
-        elif callback_data == config.PICKER_DOWN_HOUR_DATA:
-            current_hour -= 1
-            if current_hour < 0:
-                current_hour = 23
-        elif callback_data == config.PICKER_UP_MINUTE_DATA:
-            current_minute += 15
-            if current_minute == 60:
-                current_minute = 0
-        elif callback_data == config.PICKER_DOWN_MINUTE_DATA:
-            current_minute -= 15
-            if current_minute < 0:
-                current_minute = 45
-        await state.update_data(stack=stack, current_hour=current_hour, current_minute=current_minute)
+
+
+async def save_time(message: Message, tx: StateTransaction, callback_data: str, hour: int, minute: int) -> None:
+    tx.stack.append((Form.time.state, callback_data))
+    tx.update_data(time=f"{hour:02}:{minute:02}", current_hour=hour, current_minute=minute)
+    tx.set_state(Form.track)
+    await replies.show_route_list(catalog.route_pages, message, page_offset=0)
+
+
+@on_callback(Form.time, config.PICKER_SAVE_DATA)
+async def time_save_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    await save_time(callback_query.message, tx, callback_data, tx.data['current_hour'], tx.data['current_minute'])
+
+
+@on_callback(Form.time)
+async def time_grid_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    if callback_data.startswith(config.PICKER_HOUR_DATA):
+        await replies.ask_for_minute(callback_query.message, int(callback_data.removeprefix(config.PICKER_HOUR_DATA)))
+    elif callback_data.startswith(config.PICKER_TIME_DATA):
+        hour, minute = map(int, callback_data.removeprefix(config.PICKER_TIME_DATA).split(':'))
+        await save_time(callback_query.message, tx, callback_data, hour, minute)
+
+
+PICKER_STEPS = {
+    config.PICKER_UP_HOUR_DATA: (1, 0),
+    config.PICKER_DOWN_HOUR_DATA: (-1, 0),
+    config.PICKER_UP_MINUTE_DATA: (0, 15),
+    config.PICKER_DOWN_MINUTE_DATA: (0, -15),
+}
+
+
+@on_callback(Form.time, *PICKER_STEPS)
+async def time_picker_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    hour_step, minute_step = PICKER_STEPS[callback_data]
+    current_hour = (tx.data['current_hour'] + hour_step) % 24
+    current_minute = (tx.data['current_minute'] + minute_step) % 60
+    tx.update_data(current_hour=current_hour, current_minute=current_minute)
+    # a burst of arrow presses gets one edit, from the last press
+    if not superseded():
         await replies.ask_for_time(callback_query.message, current_hour, current_minute)
-    elif form_state_name == Form.track:
-        if callback_data.startswith('/route_'):
-            await process_track_data(callback_data, callback_query.message, state)
-        else:
-            await replies.show_route_list(routes, callback_query.message, page_offset=int(callback_data))
-    elif form_state_name == Form.start_point:
-        await process_start_point_data(callback_data, callback_query.message, state)
-    elif form_state_name == Form.pace:
-        state_data['pace'] = callback_data
-        route = routes[state_data['route_id']]
-        LOG.info(f'Announcement made: {state_data}')
-        state_data['route_preview'] = route.preview_id or route.preview_image
-        posting_enabled = config.TARGET_CHANNEL_NAME is not None
-        state_data['user_link'] = callback_query.from_user.mention_markdown()
-        route.preview_id = await replies.send_announcement(replies.Announcement(**state_data), callback_query.message, posting_enabled)
-        state_data['route_preview'] = route.preview_id
-        state_data['stack'] = stack
-        await state.update_data(**state_data)
-        await state.set_state(Form.announcement)
-    elif form_state_name == Form.announcement and callback_data == config.POST_TO_CHANNEL_DATA:
-        if config.TARGET_CHANNEL_NAME is None:
-            return
-        prev_post, prev_post_time = latest_posts.get(callback_query.from_user.id, (None, None))
-        if prev_post_time is None or datetime.now() - prev_post_time > timedelta(seconds=int(config.MIN_TIME_BETWEEN_POSTS)):
-            announcement = replies.Announcement(**state_data)
-            if announcement == prev_post:
-                await callback_query.message.reply(f"This announcement has already been posted.")
-                return
-
-            try:
-                await replies.post_announcement(callback_query.message, bot, announcement)
-                LOG.info(f'Announcement {announcement} posted to {config.TARGET_CHANNEL_NAME}')
-                latest_posts[callback_query.from_user.id] = (announcement, datetime.now())
-            except Exception:
-                LOG.exception("Failed to post")
-                await callback_query.message.reply(f"Unable to post. Contact my master")
-        else:
-            await callback_query.message.reply(f"You can only post once every {config.MIN_TIME_BETWEEN_POSTS} seconds.")
-
-
-async def get_stack_updated_by_command(command: str, state: FSMContext) -> List[Tuple[str, str]]:
-    stack = (await state.get_data()).get('stack', [])
-    stack.append((str(await state.get_state()), command))
-    return stack
+
+
+@on_callback(Form.track)
+async def track_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    if callback_data.startswith('/route_'):
+        await process_track_data(callback_data, callback_query.message, tx, edit=True)
+    else:
+        await replies.show_route_list(catalog.route_pages, callback_query.message, page_offset=int(callback_data))
+
+
+@on_callback(Form.start_point)
+async def start_point_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    await process_start_point_data(callback_data, callback_query.message, tx, callback_query.from_user)
+
+
+@on_callback(Form.pace)
+async def pace_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    await make_announcement(callback_query.message, callback_query.from_user, tx, callback_data)
+
+
+async def make_announcement(message: Message, user: User, tx: StateTransaction, pace: str) -> None:
+    route = catalog.get_route(tx.data['route_id'])
+    if route is None:
+        tx.set_state(Form.track)
+        await replies.route_unavailable(message)
+        await replies.show_route_list(catalog.route_pages, message, page_offset=0)
+        return
+    tx.update_data(pace=pace, user_link=user.mention_markdown())
+    LOG.info(f'Announcement made: {tx.data}')
+    posting_enabled = bool(config.TARGET_CHANNELS)
+
+    async def send(route_preview: Union[replies.InMemoryInputFile, str]) -> str:
+        announcement = replies.Announcement(**{**tx.data, 'route_preview': route_preview})
+        return await replies.send_announcement(announcement, message, posting_enabled)
+
+    tx.update_data(route_preview=await preview_uploads.send(route, send))
+    tx.set_state(Form.announcement)
+    metrics.complete_flow()
+
+
+@on_callback(Form.announcement, config.POST_TO_CHANNEL_DATA)
+async def post_callback(callback_query: CallbackQuery, tx: StateTransaction, callback_data: str) -> None:
+    if not config.TARGET_CHANNELS:
+        return
+    user_id = callback_query.from_user.id
+    announcement = replies.Announcement(**tx.data)
+    post_fingerprint = fingerprint(announcement)
+    refusal = await post_limiter.check_user(user_id, post_fingerprint)
+    if refusal is not None:
+        await callback_query.message.reply(refusal)
+        return
+
+    skipped = {}
+    for target in config.TARGET_CHANNELS:
+        refusal = await post_limiter.check_channel(target)
+        if refusal is not None:
+            skipped[target] = refusal
+    targets = [target for target in config.TARGET_CHANNELS if target not in skipped]
+
+    with send_options(retries=config.SEND_RETRIES):
+        results = await replies.post_announcement(bot, announcement, targets)
+    for target, error in results.items():
+        if error is not None:
+            LOG.error(f'Failed to post to {target}: {error!r}')
+    posted = [target for target in targets if results[target] is None]
+    if posted:
+        LOG.info(f'Announcement {announcement} posted to {posted}')
+        await post_limiter.record(user_id, posted, post_fingerprint)
+    await replies.report_posts(
+        callback_query.message, posted, [target for target in targets if results[target] is not None], skipped,
+    )
 
 
 def get_id_from_command(command: str, prefix: str) -> Union[int, None]:
@@ -216,59 +373,133 @@ def get_id_from_command(command: str, prefix: str) -> Union[int, None]:
     return int(command.split('_')[1])
 
 
-async def process_track_data(track_command, message: Message, state: FSMContext) -> None:
+async def process_track_data(track_command, message: Message, tx: StateTransaction, edit: bool = False) -> None:
     route_id = get_id_from_command(track_command, '/route_')
     if route_id is None:
         return
-    route = routes[route_id]
+    route = catalog.get_route(route_id)
+    if route is None:
+        return await replies.route_unavailable(message)
 
-    stack = await get_stack_updated_by_command(track_command, state)
-    await state.update_data(track=route.preview_message, route_id=route_id, stack=stack)
-    await state.set_state(Form.start_point)
-    await replies.ask_for_starting_point(start_points, message)
+    tx.stack.append((str(tx.state), track_command))
+    tx.update_data(track=route.preview_message, route_id=route_id)
+    tx.set_state(Form.start_point)
+    await replies.ask_for_starting_point(catalog.start_points_text, message, catalog.start_point_grid, edit)
 
 
-async def process_start_point_data(sp_command, message: Message, state: FSMContext) -> None:
+async def process_start_point_data(sp_command, message: Message, tx: StateTransaction,
+                                   user: Optional[User] = None) -> None:
     sp_id = get_id_from_command(sp_command, '/sp_')
     if sp_id is None:
         return
-    sp = start_points[sp_id]
+    sp = catalog.get_start_point(sp_id)
+    if sp is None:
+        return
 
-    stack = await get_stack_updated_by_command(sp_command, state)
-    await state.update_data(start_point=sp.formatted, stack=stack)
-    await state.set_state(Form.pace)
+    tx.stack.append((str(tx.state), sp_command))
+    tx.update_data(start_point=sp.formatted)
+    tx.set_state(Form.pace)
+    # buttons of the compact start point keyboard carry the pace as well: /sp_<id>_<pace>
+    pace = sp_command.split('_', 2)[2:]
+    if user is not None and pace and pace[0] in config.PACES:
+        return await make_announcement(message, user, tx, pace[0])
     await replies.ask_for_pace(message)
 
 
-def load_routes():
-    global routes
-    if os.path.exists(config.ROUTES_CACHE):
-        with open(config.ROUTES_CACHE, 'rb') as f:
-            routes = pickle.load(f)
-    else:
-        with open(config.ROUTES_PATH, 'r') as f_route:
-            route_links = json.load(f_route)
-        routes = list(sorted([load_route(links['route_url'], name, links['preview_url']) for name, links in route_links.items()], key=lambda r: r.name))
-        with open(config.ROUTES_CACHE, 'wb') as f_cache:
-            pickle.dump(routes, f_cache)
+async def reload_catalog(*new_routes: Tuple[str, Route]) -> str:
+    global catalog
+    async with catalog_lock:
+        previous = catalog
+        if new_routes:
+            await asyncio.to_thread(add_routes, new_routes)
+        catalog = await asyncio.to_thread(build_catalog, preview_uploads.file_ids, catalog_ids, previous)
+        preview_uploads.file_ids.retain(route.cache_key for route in catalog.routes)
+    start_prewarm()
+
+    previous_keys = {route.cache_key for route in previous.routes}
+    current_keys = {route.cache_key for route in catalog.routes}
+    summary = (
+        f"Loaded {len(catalog.routes)} routes ({len(current_keys - previous_keys)} new or changed, "
+        f"{len(previous_keys - current_keys)} removed) and {len(catalog.start_points)} starting points"
+    )
+    LOG.info(summary)
+    return summary
 
 
-def load_starting_points():
-    global start_points
-    with open(config.START_POINTS_PATH, 'r') as f_start_points:
-        start_points = [
-            StartPoint(name=name, link=sp['url'], group=sp['group'], _id=i)
-            for i, (name, sp) in enumerate(sorted(json.load(f_start_points).items(), key=lambda x: x[0]))
-        ]
+# a running pre-warm picks up routes of the new catalog by itself
+def start_prewarm():
+    global prewarm_task
+    if config.PREVIEW_STORAGE_CHAT is None or (prewarm_task is not None and not prewarm_task.done()):
+        return
+    prewarm_task = asyncio.create_task(preview_uploads.prewarm(
+        bot, config.PREVIEW_STORAGE_CHAT, lambda: catalog.routes, config.PREWARM_INTERVAL,
+    ))
+    background_tasks.add(prewarm_task)
+    prewarm_task.add_done_callback(background_tasks.discard)
 
 
-async def main():
-    load_routes()
-    load_starting_points()
+def data_mtimes() -> Tuple[float, float]:
+    return os.stat(config.ROUTES_PATH).st_mtime, os.stat(config.START_POINTS_PATH).st_mtime
+
 
-    dp = Dispatcher()
+async def watch_data_files(interval: float):
+    mtimes = data_mtimes()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current_mtimes = data_mtimes()
+            if current_mtimes != mtimes:
+                mtimes = current_mtimes
+                await reload_catalog()
+        except Exception:
+            LOG.exception("Failed to reload data")
+
+
+def create_dispatcher() -> Dispatcher:
+    # the scheduler goes before the state is loaded, so each update reads the state left by the previous one
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.update.outer_middleware(UpdateScheduler(coalesce=PICKER_STEPS))
+    dp.update.outer_middleware(TransactionMiddleware(dp.fsm))
+    dp.update.outer_middleware(UpdateMetrics())
     dp.include_router(form_router)
-    await dp.start_polling(bot)
+    return dp
+
+
+async def cancel_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+
+async def main():
+    global catalog_ids, preview_uploads, storage, post_limiter, bot
+    storage = create_storage(config.STORAGE_URL)
+    post_limiter = PostRateLimiter(storage)
+    bot = create_bot()
+    catalog_ids = IdRegistry(config.IDS_PATH)
+    preview_uploads = PreviewUploads(FileIdStore(config.FILE_IDS_PATH))
+    bot.session.middleware(SendQueue())
+    bot.session.middleware(ApiMetrics())
+    started = time.perf_counter()
+    await reload_catalog()
+    LOG.info(
+        f'Catalog loaded in {(time.perf_counter() - started) * 1000:.0f} ms, '
+        f'{time.process_time() * 1000:.0f} ms CPU since process start, '
+        f'rendering stack {"loaded" if "PIL" in sys.modules else "not loaded"}'
+    )
+    if config.METRICS_PORT:
+        await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
+    if config.DATA_RELOAD_INTERVAL > 0:
+        background_tasks.add(asyncio.create_task(watch_data_files(config.DATA_RELOAD_INTERVAL)))
+
+    dp = create_dispatcher()
+    dp.shutdown.register(cancel_background_tasks)
+    if config.BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
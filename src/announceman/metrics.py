@@ -0,0 +1,315 @@
+import bisect
+import calendar
+import logging
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, InlineQuery, Message, TelegramObject, Update
+from aiohttp import web
+
+from announceman import config
+
+
+LOG = logging.getLogger(__name__)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REGISTRY: List["Metric"] = []
+FLOW_STARTED = 'started'
+FLOW_COMPLETED = 'completed'
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues, *extra: Tuple[str, str]) -> str:
+        return _format_labels(list(zip(self.labelnames, key)) + list(extra))
+
+    def samples(self) -> Iterator[str]:
+        return iter(())
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.values.items():
+            yield f'{self.name}{self._labels(key)} {value}'
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.collect = collect
+
+    def samples(self) -> Iterator[str]:
+        yield f'{self.name} {self.collect()}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        # bucket counts followed by the +Inf count and the sum
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for key, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                yield f'{self.name}_bucket{self._labels(key, ("le", le))} {cumulative}'
+            yield f'{self.name}_sum{self._labels(key)} {counts[-1]}'
+            yield f'{self.name}_count{self._labels(key)} {cumulative}'
+
+
+class ConversationTracker:
+    def __init__(self, window: float):
+        self.window = window
+        self.last_seen: Dict[Tuple[int, int], float] = {}
+        # [api calls, started at] of announcement flows in progress
+        self.flows: Dict[Tuple[int, int], List[float]] = {}
+        self.pruned_at = time.monotonic()
+
+    def prune(self, now: float):
+        # keeps users of roughly the last two windows, whether or not metrics are scraped
+        if now - self.pruned_at < self.window:
+            return
+        self.pruned_at = now
+        self.last_seen = {key: seen_at for key, seen_at in self.last_seen.items() if now - seen_at < self.window}
+        self.flows = {key: flow for key, flow in self.flows.items() if now - flow[1] < self.window}
+
+    def seen(self, chat_id: int, user_id: int):
+        now = time.monotonic()
+        self.prune(now)
+        self.last_seen[(chat_id, user_id)] = now
+
+    def flow_step(self, chat_id: int, user_id: int, api_calls: int, event: Optional[str]) -> Optional[List[float]]:
+        key, now = (chat_id, user_id), time.monotonic()
+        if event == FLOW_STARTED:
+            self.prune(now)
+            self.flows[key] = [0, now]
+        flow = self.flows.get(key)
+        if flow is None:
+            return None
+        flow[0] += api_calls
+        if event == FLOW_COMPLETED:
+            del self.flows[key]
+            return [flow[0], now - flow[1]]
+        return None
+
+    def count(self) -> int:
+        cutoff = time.monotonic() - self.window
+        self.last_seen = {key: seen_at for key, seen_at in self.last_seen.items() if seen_at > cutoff}
+        return len(self.last_seen)
+
+
+conversations = ConversationTracker(config.METRICS_ACTIVE_WINDOW)
+
+HANDLER_SECONDS = Histogram(
+    'announceman_handler_seconds', 'Time spent handling an update', ('event', 'state', 'action'),
+)
+HANDLER_ERRORS = Counter(
+    'announceman_handler_errors_total', 'Updates whose handler raised', ('event', 'state', 'action'),
+)
+API_SECONDS = Histogram(
+    'announceman_bot_api_seconds', 'Bot API request latency, per attempt', ('method', 'result'),
+)
+INGEST_SECONDS = Histogram(
+    'announceman_ingest_seconds', 'Time to fetch, parse and render one route', ('result',),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+PREVIEW_CACHE = Counter('announceman_preview_cache_total', 'Route preview cache lookups', ('result',))
+FILE_IDS = Counter('announceman_file_id_total', 'Preview sends by whether a file_id was known', ('result',))
+UPDATES_DROPPED = Counter('announceman_updates_dropped_total', 'Updates dropped because the user queue was full')
+EDITS_COALESCED = Counter('announceman_edits_coalesced_total', 'Message edits skipped for a queued update of the same kind')
+FLOW_API_CALLS = Histogram(
+    'announceman_flow_api_calls', 'Bot API calls from /start to the announcement preview', ('mode',),
+    buckets=(4, 6, 8, 10, 12, 15, 20, 30, 50),
+)
+FLOW_SECONDS = Histogram(
+    'announceman_flow_seconds', 'Time from /start to the announcement preview', ('mode',),
+    buckets=(10, 20, 30, 60, 120, 300, 600, 1800),
+)
+ACTIVE_CONVERSATIONS = Gauge(
+    'announceman_active_conversations',
+    f'Users in a conversation who sent an update in the last {config.METRICS_ACTIVE_WINDOW:.0f}s',
+    conversations.count,
+)
+
+# actions used as label values, anything else users send is counted as "other"
+KNOWN_ACTIONS = frozenset(re.sub(r'\d+', 'N', action) for action in [
+    'text', 'inline', '0',
+    '/start', '/cancel', '/links', '/find', '/reload', '/addroute', '/route_0', '/sp_0',
+    config.GO_BACK_DATA, config.RESTART_DATA, config.NO_ACTION_DATA, config.POST_TO_CHANNEL_DATA,
+    config.PICKER_UP_HOUR_DATA, config.PICKER_DOWN_HOUR_DATA, config.PICKER_UP_MINUTE_DATA,
+    config.PICKER_DOWN_MINUTE_DATA, config.PICKER_SAVE_DATA,
+    f'{config.PICKER_HOUR_DATA}0', f'{config.PICKER_TIME_DATA}0:0',
+    *config.PACES, *(f'/sp_0_{pace}' for pace in config.PACES),
+    *(f'{month} 0' for month in calendar.month_name[1:]),
+])
+
+# [api calls, api seconds, flow event] of the update being handled, for tracing
+_trace: ContextVar[Optional[list]] = ContextVar('update_trace', default=None)
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def _flow_event(event: str):
+    trace = _trace.get()
+    if trace is not None:
+        trace[2] = event
+
+
+def start_flow():
+    _flow_event(FLOW_STARTED)
+
+
+def complete_flow():
+    _flow_event(FLOW_COMPLETED)
+
+
+def action_of(event: TelegramObject) -> str:
+    if isinstance(event, CallbackQuery):
+        text = event.data or ''
+    elif isinstance(event, Message):
+        text = (event.text or '').split(maxsplit=1)[0].split('@')[0] if (event.text or '').startswith('/') else 'text'
+    elif isinstance(event, InlineQuery):
+        return 'inline'
+    else:
+        return ''
+    # route and start point ids, page numbers and dates would make labels unbounded
+    action = re.sub(r'\d+', 'N', text)
+    return action if action in KNOWN_ACTIONS else 'other'
+
+
+class UpdateMetrics(BaseMiddleware):
+    def __init__(self, trace: bool = config.TRACE_UPDATES):
+        self.trace = trace
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        inner = event.event
+        state, action = data.get('raw_state') or '', action_of(inner)
+        user, chat = data.get('event_from_user'), data.get('event_chat')
+        if state and user is not None and chat is not None:
+            conversations.seen(chat.id, user.id)
+
+        trace = [0, 0.0, None]
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(event=event.event_type, state=state, action=action)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+            HANDLER_SECONDS.observe(elapsed, event=event.event_type, state=state, action=action)
+            if self.trace:
+                LOG.info(
+                    f'update {event.update_id} {event.event_type} state={state} action={action} '
+                    f'took {elapsed * 1000:.1f} ms, {trace[0]} API calls in {trace[1] * 1000:.1f} ms'
+                )
+            flow = conversations.flow_step(chat.id, user.id, trace[0], trace[2]) if user and chat else None
+            if flow is not None:
+                api_calls, seconds = flow
+                FLOW_API_CALLS.observe(api_calls, mode=config.FLOW_MODE)
+                FLOW_SECONDS.observe(seconds, mode=config.FLOW_MODE)
+                LOG.info(f'Announcement flow of user {user.id} took {api_calls} API calls in {seconds:.0f}s')
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        result = 'ok'
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            API_SECONDS.observe(elapsed, method=type(method).__name__, result=result)
+            trace = _trace.get()
+            if trace is not None:
+                trace[0] += 1
+                trace[1] += elapsed
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    LOG.info(f'Serving metrics at {host}:{port}/metrics')
+    return runner
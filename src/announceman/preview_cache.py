@@ -0,0 +1,151 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+from announceman.route import Route, RENDER_VERSION
+
+
+LOG = logging.getLogger(__name__)
+INDEX_FILE = 'index.json'
+ORPHANS_FILE = 'orphans.json'
+PREVIEW_SUFFIX = '.preview'
+
+
+def route_key(route_url: str, name: str, preview_url: Optional[str]) -> str:
+    return hashlib.sha256(json.dumps([route_url, name, preview_url, RENDER_VERSION]).encode()).hexdigest()[:32]
+
+
+# bot processes sharing the data folder write the same files, writes that merge with the file
+# hold its lock. Lock files are hidden, the data folder is usually a git checkout
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    directory, name = os.path.split(path)
+    with open(os.path.join(directory, name if name.startswith('.') else '.' + name) + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        # mkstemp creates files readable by the owner only
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class PreviewCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self.orphans_path = os.path.join(path, ORPHANS_FILE)
+        os.makedirs(path, exist_ok=True)
+        self.index: Dict[str, dict] = _read_json(self.index_path)
+        self._added: Dict[str, dict] = {}
+
+    def _preview_path(self, key: str) -> str:
+        return os.path.join(self.path, key + PREVIEW_SUFFIX)
+
+    def get(self, key: str) -> Optional[Route]:
+        meta = self.index.get(key)
+        if meta is None or not os.path.exists(self._preview_path(key)):
+            return None
+        # length and elevation are parsed again, so parser fixes apply to cached routes as well
+        meta = {**meta, 'length_km': None, 'elevation_m': None}
+        return Route(**meta, cache_key=key, preview_path=self._preview_path(key))
+
+    # the preview is read from the file from now on, like previews of routes loaded from the cache
+    def put(self, key: str, route: Route):
+        _write_atomic(self._preview_path(key), route.preview_image)
+        route.cache_key = key
+        route.preview_path = self._preview_path(key)
+        route.preview_image = None
+        self.index[key] = self._added[key] = dict(
+            name=route.name,
+            length=route.length,
+            elevation=route.elevation,
+            link=route.link,
+            preview_message=route.preview_message,
+            length_km=route.length_km,
+            elevation_m=route.elevation_m,
+        )
+
+    # must hold the index lock, entries other processes added since the index was read are kept
+    def _merge(self):
+        self.index = {**_read_json(self.index_path), **self._added}
+        self._added.clear()
+
+    def _write(self):
+        _write_atomic(self.index_path, json.dumps(self.index, separators=(',', ':')).encode())
+
+    def save(self):
+        with file_lock(self.index_path):
+            self._merge()
+            self._write()
+
+    # bot processes that haven't reloaded yet still send previews of removed routes,
+    # so previews are only removed once nothing has used them for the grace period
+    def collect_garbage(self, keys: Iterable[str], grace: float):
+        keep = set(keys)
+        now = time.time()
+        with file_lock(self.index_path):
+            self._merge()
+            files = {filename[:-len(PREVIEW_SUFFIX)] for filename in os.listdir(self.path)
+                     if filename.endswith(PREVIEW_SUFFIX)}
+            known_orphans = _read_json(self.orphans_path)
+            orphans = {key: known_orphans.get(key, now) for key in (set(self.index) | files) - keep}
+            for key, since in list(orphans.items()):
+                if now - since < grace:
+                    continue
+                LOG.info('Removing orphaned preview %s', key)
+                self.index.pop(key, None)
+                if key in files:
+                    os.remove(self._preview_path(key))
+                del orphans[key]
+            self._write()
+            if orphans != known_orphans:
+                _write_atomic(self.orphans_path, json.dumps(orphans, separators=(',', ':')).encode())
+
+
+class FileIdStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.file_ids: Dict[str, str] = _read_json(path)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.file_ids.get(key)
+
+    # file_ids recorded by other processes since the file was read are kept
+    def set(self, key: str, file_id: str):
+        with file_lock(self.path):
+            self.file_ids = {**_read_json(self.path), key: file_id}
+            self._write()
+
+    def retain(self, keys: Iterable[str]):
+        keep = set(keys)
+        with file_lock(self.path):
+            file_ids = _read_json(self.path)
+            self.file_ids = {key: file_id for key, file_id in file_ids.items() if key in keep}
+            if len(self.file_ids) < len(file_ids):
+                self._write()
+
+    def _write(self):
+        _write_atomic(self.path, json.dumps(self.file_ids, separators=(',', ':')).encode())
@@ -0,0 +1,204 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from pydantic.dataclasses import dataclass
+
+
+PreviewInfo = Tuple[str, str, str, str]
+
+
+@dataclass(frozen=True)
+class ElementField:
+    attr: str
+    value: str
+    occurrence: int = 0
+
+    def matches(self, attrs: Dict[str, str]) -> bool:
+        value = attrs.get(self.attr)
+        if value is None:
+            return False
+        if self.attr == 'class':
+            return self.value in value.split()
+        return value == self.value
+
+
+@dataclass
+class Provider:
+    domain: str
+    meta: Tuple[str, ...]
+    elements: Dict[str, ElementField]
+    parse: Callable[[Dict[str, str]], PreviewInfo]
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return self.meta + tuple(self.elements)
+
+
+PROVIDERS: List[Provider] = []
+LENGTH_UNITS_KM = {'': 1, 'km': 1, 'mi': 1.609344, 'm': 0.001}
+ELEVATION_UNITS_M = {'': 1, 'm': 1, 'ft': 0.3048}
+# "1 234 m" with a (narrow) no-break or thin space between digit groups is one number
+_QUANTITY = re.compile(r'(\d{1,3}(?:[ \u2009\u202f]\d{3})+(?:[.,]\d+)?(?!\d)|\d[\d.,]*)\s*([a-z]*)', re.IGNORECASE)
+_GROUP_SEPARATORS = re.compile('[ \u2009\u202f]')
+
+
+def register(provider: Provider) -> Provider:
+    PROVIDERS.append(provider)
+    return provider
+
+
+def get_provider(route_url: str) -> Provider:
+    domain = urlparse(route_url).netloc
+    for provider in PROVIDERS:
+        if provider.domain in domain:
+            return provider
+    raise Exception(f'Only {", ".join(p.domain for p in PROVIDERS)} routes are supported')
+
+
+class _FieldsFound(Exception):
+    pass
+
+
+class FieldsParser(HTMLParser):
+    def __init__(self, provider: Provider):
+        super().__init__()
+        self.provider = provider
+        self.fields: Dict[str, str] = {}
+        self._occurrences = {name: 0 for name in provider.elements}
+        self._capture = None
+        self._capture_depth = 0
+        self._capture_parts = []
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name in self.provider.fields if name not in self.fields]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: value for key, value in attrs if value is not None}
+        if self._capture is not None:
+            if tag == self._capture[1]:
+                self._capture_depth += 1
+            return
+
+        if tag == 'meta':
+            key = attrs.get('property') or attrs.get('name')
+            if key in self.provider.meta and key not in self.fields:
+                self.fields[key] = attrs.get('content', '')
+                self._check_done()
+            return
+
+        for name, element in self.provider.elements.items():
+            if name in self.fields or not element.matches(attrs):
+                continue
+            if self._occurrences[name] == element.occurrence:
+                self._capture = (name, tag)
+                self._capture_depth = 1
+                self._capture_parts = []
+                return
+            self._occurrences[name] += 1
+
+    def handle_endtag(self, tag):
+        if self._capture is None or tag != self._capture[1]:
+            return
+        self._capture_depth -= 1
+        if self._capture_depth == 0:
+            self.fields[self._capture[0]] = ''.join(self._capture_parts)
+            self._capture = None
+            self._check_done()
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._capture_parts.append(data)
+
+    def _check_done(self):
+        if not self.missing:
+            raise _FieldsFound()
+
+
+def extract(route_url: str, chunks: Iterable[bytes]) -> PreviewInfo:
+    provider = get_provider(route_url)
+    parser = FieldsParser(provider)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    try:
+        for chunk in chunks:
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+    except _FieldsFound:
+        pass
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+    if parser.missing:
+        raise Exception(f'Fields {parser.missing} not found at {route_url}')
+    return provider.parse(parser.fields)
+
+
+def _parse_quantity(text: str, units: Dict[str, float]) -> Optional[float]:
+    match = _QUANTITY.search(text.replace('\xa0', ' '))
+    if match is None:
+        return None
+    number, unit = match.groups()
+    number = _GROUP_SEPARATORS.sub('', number)
+    factor = units.get(unit.lower())
+    if factor is None:
+        return None
+    if ',' in number and '.' in number:
+        # the last separator is the decimal one: "1,234.5" and "1.234,5"
+        number = number.replace(',' if number.rfind(',') < number.rfind('.') else '.', '')
+    elif re.fullmatch(r'\d{1,3}(,\d{3})+', number):
+        number = number.replace(',', '')
+    try:
+        return float(number.replace(',', '.')) * factor
+    except ValueError:
+        return None
+
+
+def parse_length(text: str) -> Optional[float]:
+    return _parse_quantity(text, LENGTH_UNITS_KM)
+
+
+def parse_elevation(text: str) -> Optional[float]:
+    return _parse_quantity(text, ELEVATION_UNITS_M)
+
+
+def _parse_strava(fields: Dict[str, str]) -> PreviewInfo:
+    name, length = fields['og:description'].split(' Cycling Route. ')[0].split(' is a ')
+    return name, length, fields['elevation'], fields['og:image']
+
+
+def _parse_komoot(fields: Dict[str, str]) -> PreviewInfo:
+    name = fields['og:title'].split(' | ')[0]
+    length = fields['og:description'].split('Distance: ')[1].split(' | ')[0].replace('\xa0', '')
+    elevation = fields['elevation'].replace('\xa0', '')
+    return name, length, elevation, fields['og:image']
+
+
+def _parse_ridewithgps(fields: Dict[str, str]) -> PreviewInfo:
+    length, elevation = fields['og:description'].split('. Bike ride in ')[0].split(', +')
+    return fields['og:title'], length, elevation, fields['twitter:image']
+
+
+register(Provider(
+    domain='strava.com',
+    meta=('og:image', 'og:description'),
+    elements={'elevation': ElementField(attr='class', value='Detail_routeStat__7yEdS', occurrence=1)},
+    parse=_parse_strava,
+))
+register(Provider(
+    domain='komoot.com',
+    meta=('og:image', 'og:title', 'og:description'),
+    elements={'elevation': ElementField(attr='data-test-id', value='t_elevation_up_value')},
+    parse=_parse_komoot,
+))
+register(Provider(
+    domain='ridewithgps.com',
+    meta=('og:title', 'og:description', 'twitter:image'),
+    elements={},
+    parse=_parse_ridewithgps,
+))
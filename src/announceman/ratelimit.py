@@ -0,0 +1,52 @@
+import hashlib
+import time
+from typing import Iterable, Optional, Union
+
+from announceman import config
+from announceman.replies import Announcement
+from announceman.storage import RecordStorage
+
+
+def fingerprint(announcement: Announcement) -> str:
+    return hashlib.sha256(announcement.get_announcement_text().encode()).hexdigest()[:16]
+
+
+class PostRateLimiter:
+    def __init__(
+        self,
+        storage: RecordStorage,
+        user_window: int = config.MIN_TIME_BETWEEN_POSTS,
+        channel_window: int = config.MIN_TIME_BETWEEN_CHANNEL_POSTS,
+        duplicate_window: int = config.DUPLICATE_POST_WINDOW,
+    ):
+        self.storage = storage
+        self.user_window = user_window
+        self.channel_window = channel_window
+        self.duplicate_window = duplicate_window
+
+    async def check_user(self, user_id: int, post_fingerprint: str) -> Optional[str]:
+        user_post = await self.storage.get_record(f'post:user:{user_id}')
+        if user_post is not None:
+            if time.time() - user_post['posted_at'] < self.user_window:
+                return f"You can only post once every {self.user_window} seconds."
+            if user_post['fingerprint'] == post_fingerprint:
+                return "This announcement has already been posted."
+        return None
+
+    async def check_channel(self, channel: Union[int, str]) -> Optional[str]:
+        if self.channel_window:
+            channel_post = await self.storage.get_record(f'post:channel:{channel}')
+            if channel_post is not None and time.time() - channel_post['posted_at'] < self.channel_window:
+                return f"Only one announcement can be posted to {channel} every {self.channel_window} seconds."
+        return None
+
+    async def record(self, user_id: int, channels: Iterable[Union[int, str]], post_fingerprint: str):
+        now = time.time()
+        await self.storage.set_record(
+            f'post:user:{user_id}',
+            {'fingerprint': post_fingerprint, 'posted_at': now},
+            ttl=max(self.user_window, self.duplicate_window),
+        )
+        if self.channel_window:
+            for channel in channels:
+                await self.storage.set_record(f'post:channel:{channel}', {'posted_at': now}, ttl=self.channel_window)
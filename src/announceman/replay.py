@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+from aiohttp import ClientSession
+
+from announceman import config
+
+
+async def replay(path: str, url: str, secret: str, concurrency: int) -> Counter:
+    with open(path, 'r') as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    statuses = Counter()
+    slots = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with ClientSession(headers=headers) as session:
+        async def post(update: dict):
+            async with slots, session.post(url, json=update) as response:
+                statuses[response.status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f'Posted {len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.1f}/s): {dict(statuses)}')
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='POST recorded Telegram updates (one JSON per line) to a webhook')
+    parser.add_argument('updates')
+    parser.add_argument('--url', default=f'http://127.0.0.1:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}')
+    parser.add_argument('--secret', default=config.WEBHOOK_SECRET)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(replay(args.updates, args.url, args.secret, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,40 @@
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import Optional, AsyncGenerator, List, Union, Tuple
+from mmap import mmap
+from typing import Dict, Optional, AsyncGenerator, List, Union, Tuple
 
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.types import (Message, LinkPreviewOptions, InlineKeyboardMarkup,
-                           InlineKeyboardButton, ReplyKeyboardRemove, InputFile)
+                           InlineKeyboardButton, ReplyKeyboardRemove, InputFile,
+                           InlineQuery, InlineQueryResultArticle, InputTextMessageContent)
 from aiogram.types.input_file import DEFAULT_CHUNK_SIZE
+from pydantic import ConfigDict
 from pydantic.dataclasses import dataclass
 
 from announceman import config
 from announceman.config import POST_TO_CHANNEL_DATA
-from announceman.route_preview import Route
+from announceman.route import Route
 
 
 LOG = logging.getLogger(__name__)
 
 
-@dataclass
+class InMemoryInputFile(InputFile):
+    def __init__(self, data: Union[bytes, memoryview, mmap], filename: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename, chunk_size)
+        self.data = memoryview(data)
+
+    async def read(self, bot: "Bot") -> AsyncGenerator[memoryview, None]:
+        for offset in range(0, len(self.data), self.chunk_size):
+            yield self.data[offset:offset + self.chunk_size]
+
+
+@dataclass(config=ConfigDict(arbitrary_types_allowed=True))
 class Announcement:
-    route_preview: Union[bytes, str]
+    route_preview: Union[InMemoryInputFile, str]
     date: str
     track: str
     time: str
@@ -27,9 +42,7 @@ class Announcement:
     pace: str
     user_link: Union[str, None]
 
-    def get_route_preview(self) -> Union["InMemoryInputFile", str]:
-        if isinstance(self.route_preview, bytes):
-            return InMemoryInputFile(self.route_preview)
+    def get_route_preview(self) -> Union[InMemoryInputFile, str]:
         return self.route_preview
 
     def get_announcement_text(self) -> str:
@@ -42,19 +55,6 @@ class Announcement:
         )
 
 
-class InMemoryInputFile(InputFile):
-    def __init__(self, data: bytes, filename: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
-        super().__init__(filename, chunk_size)
-        self.bytes = data
-
-    async def read(self, bot: "Bot") -> AsyncGenerator[bytes, None]:
-        offset = 0
-        while offset < len(self.bytes):
-            chunk = self.bytes[offset:offset + self.chunk_size]
-            offset += self.chunk_size
-            yield chunk
-
-
 async def canceled(message: Message):
     await message.answer("Cancelled.", reply_markup=ReplyKeyboardRemove())
 
@@ -75,22 +75,66 @@ async def ask_for_date(message: Message):
     )
 
 
-async def show_route_list(routes: List[Route], message: Message, page_offset: int):
-    route_previews = [
-        f'{route.preview_message}\n{route.length} | {route.elevation} --> /route\_{i}\n'
-        for i, route in enumerate(routes)
-    ]
-    offset = int(page_offset) * config.ROUTE_LIST_PAGE_LEN
+def format_route_preview(route: Route) -> str:
+    return f'{route.preview_message}\n{route.length} | {route.elevation} --> /route\_{route._id}\n'
 
-    await message.edit_text(
-        "\n".join(route_previews[offset:offset + config.ROUTE_LIST_PAGE_LEN]),
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text=str(i), callback_data=str(i) if i != page_offset else config.NO_ACTION_DATA)
-                for i in range(len(route_previews) // config.ROUTE_LIST_PAGE_LEN + 1)
-            ],
-            config.KEYBOARD_SERVICE_LINE,
-        ])
+
+def rows(buttons: List[InlineKeyboardButton], row_len: int = config.KEYBOARD_ROW_LEN) -> List[List[InlineKeyboardButton]]:
+    return [buttons[offset:offset + row_len] for offset in range(0, len(buttons), row_len)]
+
+
+def render_route_pages(routes: List[Route]) -> List[Tuple[str, InlineKeyboardMarkup]]:
+    route_previews = [format_route_preview(route) for route in routes]
+    page_count = max(1, -(-len(route_previews) // config.ROUTE_LIST_PAGE_LEN))
+    buttons = [InlineKeyboardButton(text=str(i), callback_data=str(i)) for i in range(page_count)]
+
+    pages = []
+    for page in range(page_count):
+        offset = page * config.ROUTE_LIST_PAGE_LEN
+        current = InlineKeyboardButton(text=str(page), callback_data=config.NO_ACTION_DATA)
+        route_buttons = [
+            InlineKeyboardButton(text=route.name, callback_data=f'/route_{route._id}')
+            for route in routes[offset:offset + config.ROUTE_LIST_PAGE_LEN]
+        ] if config.FLOW_MODE == "compact" else []
+        pages.append((
+            "\n".join(route_previews[offset:offset + config.ROUTE_LIST_PAGE_LEN]),
+            InlineKeyboardMarkup(inline_keyboard=[
+                *rows(route_buttons, 2),
+                *rows(buttons[:page] + [current] + buttons[page + 1:]),
+                config.KEYBOARD_SERVICE_LINE,
+            ]),
+        ))
+    return pages
+
+
+async def show_route_list(route_pages: List[Tuple[str, InlineKeyboardMarkup]], message: Message, page_offset: int):
+    if not 0 <= page_offset < len(route_pages):
+        return
+    text, reply_markup = route_pages[page_offset]
+    await message.edit_text(text, reply_markup=reply_markup)
+
+
+async def send_found_routes(routes: List[Route], message: Message):
+    if not routes:
+        await message.reply("No routes found. Try fewer words or wider ranges, e.g. `/find sea 40-80km >500m`")
+        return
+    found = "\n".join(format_route_preview(route) for route in routes[:config.FIND_RESULTS_LIMIT])
+    more = len(routes) - config.FIND_RESULTS_LIMIT
+    await message.reply(found + (f"\n...and {more} more" if more > 0 else ""))
+
+
+async def answer_inline_routes(routes: List[Route], inline_query: InlineQuery):
+    await inline_query.answer(
+        [
+            InlineQueryResultArticle(
+                id=str(route._id),
+                title=route.name,
+                description=f'{route.length} | {route.elevation}',
+                input_message_content=InputTextMessageContent(message_text=f'/route_{route._id}', parse_mode=None),
+            )
+            for route in routes[:config.INLINE_RESULTS_LIMIT]
+        ],
+        cache_time=config.INLINE_CACHE_TIME,
     )
 
 
@@ -116,22 +160,49 @@ async def ask_for_time(message: Message, current_hour: int, current_minute: int)
     )
 
 
+async def ask_for_hour(message: Message):
+    hours = [
+        InlineKeyboardButton(text=f'{hour:02}', callback_data=f'{config.PICKER_HOUR_DATA}{hour}')
+        for hour in range(24)
+    ]
+    await message.edit_text(
+        "Pick an hour",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[*rows(hours, 6), config.KEYBOARD_SERVICE_LINE]),
+    )
+
+
+async def ask_for_minute(message: Message, hour: int):
+    times = [
+        InlineKeyboardButton(text=f'{hour:02}:{minute:02}', callback_data=f'{config.PICKER_TIME_DATA}{hour}:{minute}')
+        for minute in range(0, 60, 15)
+    ]
+    await message.edit_text(
+        "Pick a time",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[times, config.KEYBOARD_SERVICE_LINE]),
+    )
+
+
+async def route_unavailable(message: Message):
+    await message.reply("This route is no longer available, please pick another one.")
+
+
 async def ask_for_pace(message: Message):
     await message.reply(
         "Define a pace",
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[
-                [
-                    InlineKeyboardButton(text="Easy", callback_data="Easy"),
-                    InlineKeyboardButton(text="Z2", callback_data="Z2"),
-                    InlineKeyboardButton(text="FAST", callback_data="FAST"),
-                ],
+                [InlineKeyboardButton(text=pace, callback_data=pace) for pace in config.PACES],
                 config.KEYBOARD_SERVICE_LINE,
             ],
         ),
     )
 
 
+# photo sizes go from the smallest thumbnail to the original, the file_id of the original is the one to reuse
+def photo_file_id(message: Message) -> str:
+    return message.photo[-1].file_id
+
+
 async def send_announcement(announcement: Announcement, message: Message, posting_enabled: bool = False) -> str:
     reply_obj = await message.reply_photo(
         photo=announcement.get_route_preview(),
@@ -143,23 +214,47 @@ async def send_announcement(announcement: Announcement, message: Message, postin
             ],
         ),
     )
-    return reply_obj.photo[0].file_id
+    return photo_file_id(reply_obj)
 
 
-async def ask_for_starting_point(starting_points: List["StartPoint"], message: Message):
+def render_starting_points(starting_points: List["StartPoint"]) -> str:
     grouped_points = {}
     for sp in starting_points:
         if sp.group not in grouped_points:
             grouped_points[sp.group] = []
         grouped_points[sp.group].append(f"{sp.formatted} --> /sp\_{sp._id}")
 
-    await message.reply(
-        f"Choose a starting point\n\n{"\n".join(
-            f"{group}:\n{"\n".join(points)}"
-            for group, points in sorted(grouped_points.items(), key=lambda x: x[0])
-        )}",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[config.KEYBOARD_SERVICE_LINE]),
-    )
+    return f"Choose a starting point\n\n{"\n".join(
+        f"{group}:\n{"\n".join(points)}"
+        for group, points in sorted(grouped_points.items(), key=lambda x: x[0])
+    )}"
+
+
+# a row per starting point with a button per pace, compact flow only and when it fits into one keyboard
+def render_start_point_grid(starting_points: List["StartPoint"]) -> Optional[InlineKeyboardMarkup]:
+    row_len = len(config.PACES) + 1
+    if config.FLOW_MODE != "compact" or not starting_points or row_len > config.KEYBOARD_ROW_LEN or \
+            len(starting_points) * row_len + len(config.KEYBOARD_SERVICE_LINE) > config.KEYBOARD_MAX_BUTTONS:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        *(
+            [InlineKeyboardButton(text=sp.name, callback_data=config.NO_ACTION_DATA)] + [
+                InlineKeyboardButton(text=pace, callback_data=f'/sp_{sp._id}_{pace}') for pace in config.PACES
+            ]
+            for sp in sorted(starting_points, key=lambda sp: sp.group)
+        ),
+        config.KEYBOARD_SERVICE_LINE,
+    ])
+
+
+async def ask_for_starting_point(starting_points_text: str, message: Message,
+                                 grid: Optional[InlineKeyboardMarkup] = None, edit: bool = False):
+    reply_markup = grid or InlineKeyboardMarkup(inline_keyboard=[config.KEYBOARD_SERVICE_LINE])
+    # the compact keyboard replaces the route list, photos can't be edited into a text message
+    if edit and grid is not None and message.text is not None:
+        await message.edit_text(starting_points_text, reply_markup=reply_markup)
+    else:
+        await message.reply(starting_points_text, reply_markup=reply_markup)
 
 
 async def send_links(routes: List[str], start_points: List[str], message: Message):
@@ -168,10 +263,47 @@ async def send_links(routes: List[str], start_points: List[str], message: Messag
     )
 
 
-async def post_announcement(message: Message, bot: Bot, announcement: Announcement):
-    await bot.send_photo(
-        chat_id=config.TARGET_CHANNEL_NAME,
-        photo=announcement.get_route_preview(),
-        caption=announcement.get_announcement_text(),
+async def post_announcement(
+    bot: Bot, announcement: Announcement, targets: List[Union[int, str]],
+) -> Dict[Union[int, str], Optional[Exception]]:
+    results = {}
+    photo, pending = announcement.get_route_preview(), list(targets)
+    # upload the preview once, the other targets get its file_id
+    while pending and not isinstance(photo, str):
+        target = pending.pop(0)
+        try:
+            posted = await bot.send_photo(chat_id=target, photo=photo, caption=announcement.get_announcement_text())
+            photo, results[target] = photo_file_id(posted), None
+        except Exception as e:
+            results[target] = e
+
+    outcomes = await asyncio.gather(
+        *(bot.send_photo(chat_id=target, photo=photo, caption=announcement.get_announcement_text())
+          for target in pending),
+        return_exceptions=True,
     )
-    await message.reply(f"Posted to {config.TARGET_CHANNEL_NAME}")
+    for target, outcome in zip(pending, outcomes):
+        results[target] = outcome if isinstance(outcome, Exception) else None
+    return results
+
+
+async def report_posts(message: Message, posted: List[Union[int, str]], failed: List[Union[int, str]],
+                       skipped: Dict[Union[int, str], str]):
+    lines = []
+    if posted:
+        lines.append(f"Posted to {', '.join(map(str, posted))}")
+    if failed:
+        lines.append(f"Unable to post to {', '.join(map(str, failed))}. Contact my master")
+    lines.extend(f"Not posted to {target}: {reason}" for target, reason in skipped.items())
+    await message.reply("\n".join(lines), parse_mode=None)
+
+
+async def ask_for_route_urls(message: Message):
+    await message.reply(
+        "Send route links, one per line, optionally followed by a route name:\n/addroute <url> [name]",
+        parse_mode=None,
+    )
+
+
+def format_ingest_progress(statuses: List[str], done: int) -> str:
+    return f"Loaded {done} of {len(statuses)} routes\n\n" + "\n".join(statuses)
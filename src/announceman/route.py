@@ -0,0 +1,30 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from announceman.providers import parse_length, parse_elevation
+
+
+# bump when rendering output changes to invalidate cached previews
+RENDER_VERSION = 2
+
+
+@dataclass(slots=True)
+class Route:
+    name: str
+    length: str
+    elevation: str
+    link: str
+    preview_message: str
+    preview_image: Optional[bytes] = None
+    preview_id: Optional[str] = None
+    cache_key: Optional[str] = None
+    preview_path: Optional[str] = None
+    length_km: Optional[float] = None
+    elevation_m: Optional[float] = None
+    _id: Optional[int] = None
+
+    def __post_init__(self):
+        if self.length_km is None:
+            self.length_km = parse_length(self.length)
+        if self.elevation_m is None:
+            self.elevation_m = parse_elevation(self.elevation)
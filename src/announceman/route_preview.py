@@ -1,87 +1,99 @@
+from functools import lru_cache
 from io import BytesIO
-from typing import Tuple
+from typing import Tuple, Callable, Iterator
 from urllib.parse import urlparse
-from urllib.request import urlopen
 
 import requests
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
 
-from bs4 import BeautifulSoup
-from pydantic.dataclasses import dataclass
+from announceman.providers import extract, parse_length, parse_elevation
+from announceman.route import Route
 
 
-@dataclass
-class Route:
-    name: str
-    length: str
-    elevation: str
-    link: str
-    preview_message: str
-    preview_image: bytes
-    preview_id: str = None
+# telegram keeps photos at most 1280px on the longest side
+PREVIEW_MAX_SIZE = 1280
+PREVIEW_JPEG_QUALITY = 85
+MIN_FONT_SIZE = 8
+PAGE_CHUNK_SIZE = 16 * 1024
+
+
+@lru_cache(maxsize=1)
+def _base_font() -> ImageFont.FreeTypeFont:
+    return ImageFont.load_default(size=MIN_FONT_SIZE)
+
+
+@lru_cache(maxsize=64)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    return _base_font().font_variant(size=size)
+
+
+def _fit_font(text: str, width: int, max_size: int) -> ImageFont.FreeTypeFont:
+    low, high = MIN_FONT_SIZE, max(max_size, MIN_FONT_SIZE)
+    while low < high:
+        size = (low + high + 1) // 2
+        if _font(size).getlength(text) <= width:
+            low = size
+        else:
+            high = size - 1
+    return _font(low)
 
 
 def add_title_to_image(image_data: bytes, text: str) -> bytes:
-    img = Image.open(BytesIO(image_data)).convert('RGB')
+    img = Image.open(BytesIO(image_data))
+    img.draft('RGB', (PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))
+    img = img.convert('RGB')
+    img.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE), Image.Resampling.LANCZOS)
     draw = ImageDraw.Draw(img, 'RGB')
 
-    font_size = round(img.height * 0.1)
-    text_length = draw.textlength(text, font_size=font_size)
-    while text_length > img.width:
-        font_size -= 5
-        text_length = draw.textlength(text, font_size=font_size)
-
-    x = (img.width - text_length) / 2
+    font = _fit_font(text, img.width, round(img.height * 0.1))
+    x = (img.width - font.getlength(text)) / 2
     y = round(img.height * 0.85)
 
-    draw.text((x, y), text, fill=(0, 0, 0), font_size=font_size)
+    draw.text((x, y), text, fill=(0, 0, 0), font=font)
 
     img_io = BytesIO()
-    img.save(img_io, 'JPEG')
+    img.save(img_io, 'JPEG', quality=PREVIEW_JPEG_QUALITY, optimize=True, progressive=True)
     return img_io.getvalue()
 
 
-def get_preview_info(route_url) -> Tuple[str, str, str, str]:
-    html = urlopen(route_url).read()
-    soup = BeautifulSoup(html, 'html.parser')
-    domain = urlparse(route_url).netloc
-
-    def get_meta_content(**kwargs):
-        return soup.find("meta", **kwargs)['content']
-
-    img_link = get_meta_content(property='og:image')
-    if 'strava.com' in domain:
-        name, length = get_meta_content(property='og:description').split(' Cycling Route. ')[0].split(' is a ')
-        elevation = soup.find_all(**{"class":"Detail_routeStat__7yEdS"})[1].get_text()
-    elif 'komoot.com' in domain:
-        name = get_meta_content(property='og:title').split(' | ')[0]
-        length = get_meta_content(property='og:description').split('Distance: ')[1].split(' | ')[0].replace('\xa0', '')
-        elevation = soup.find(**{"data-test-id": "t_elevation_up_value"}).get_text().replace('\xa0', '')
-    elif 'ridewithgps.com' in domain:
-        name = get_meta_content(property='og:title')
-        length, elevation = get_meta_content(property='og:description').split('. Bike ride in ')[0].split(', +')
-        img_link = soup.find("meta", attrs={'name': 'twitter:image'})['content']
-    else:
-        raise Exception('Only komoot and strava routes are supported')
+def fetch_url(url: str) -> bytes:
+    response = requests.get(url)
+    if response.status_code != 200:
+        raise Exception(f'Failed to fetch {url}: {response.status_code}')
+    return response.content
+
 
-    return name, length, elevation, img_link
+def stream_url(url: str) -> Iterator[bytes]:
+    with requests.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f'Failed to fetch {url}: {response.status_code}')
+        yield from response.iter_content(PAGE_CHUNK_SIZE)
 
 
-def load_route(route_url, route_name=None, route_pic=None) -> Route:
+def get_preview_info(route_url, stream: Callable[[str], Iterator[bytes]] = stream_url) -> Tuple[str, str, str, str]:
+    return extract(route_url, stream(route_url))
+
+
+def load_route(
+    route_url,
+    route_name=None,
+    route_pic=None,
+    fetch: Callable[[str], bytes] = fetch_url,
+    stream: Callable[[str], Iterator[bytes]] = stream_url,
+    render: Callable[[bytes, str], bytes] = add_title_to_image,
+) -> Route:
     if route_name is not None:
         print('loading route', route_name)
-    name, length, elevation, img_link = get_preview_info(route_url)
+    name, length, elevation, img_link = get_preview_info(route_url, stream)
     name = route_name or name
     img_link = route_pic or img_link
 
-    response = requests.get(img_link)
-    if response.status_code != 200:
-        raise Exception('Failed to fetch image')
+    image_data = fetch(img_link)
 
     if 'ridewithgps.com' in urlparse(img_link).netloc:
-        preview_image = response.content
+        preview_image = image_data
     else:
-        preview_image = add_title_to_image(response.content, f"{name} | {length} | {elevation}")
+        preview_image = render(image_data, f"{name} | {length} | {elevation}")
 
     return Route(
         name=name,
@@ -90,4 +102,6 @@ def load_route(route_url, route_name=None, route_pic=None) -> Route:
         link=route_url,
         preview_message=f"[{name}]({route_url})",
         preview_image=preview_image,
+        length_km=parse_length(length),
+        elevation_m=parse_elevation(elevation),
     )
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Collection, Deque, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject, Update
+
+from announceman import config, metrics
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Turn:
+    __slots__ = ('coalesce', 'done')
+
+    def __init__(self, coalesce: bool):
+        self.coalesce = coalesce
+        self.done = asyncio.get_running_loop().create_future()
+
+
+_current: ContextVar[Optional[Tuple[Deque[Turn], Turn]]] = ContextVar('scheduled_update', default=None)
+
+
+def superseded() -> bool:
+    current = _current.get()
+    if current is None or not current[1].coalesce:
+        return False
+    queue, turn = current
+    position = queue.index(turn)
+    if position + 1 < len(queue) and queue[position + 1].coalesce:
+        metrics.EDITS_COALESCED.inc()
+        return True
+    return False
+
+
+# updates of different users are handled in parallel, updates of one user in a chat one at a time
+# and in arrival order. Must run before the fsm middleware, so the state is read in turn.
+# Queues live in this process, updates of one user handled by different webhook workers can still overlap
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, max_pending: int = config.USER_QUEUE_LIMIT, coalesce: Collection[str] = ()):
+        self.max_pending = max_pending
+        self.coalesce = frozenset(coalesce)
+        self._queues: Dict[Tuple[int, int], Deque[Turn]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user, chat = data.get('event_from_user'), data.get('event_chat')
+        # inline queries have no chat and don't touch the conversation state
+        if user is None or chat is None:
+            return await handler(event, data)
+
+        key = (chat.id, user.id)
+        queue = self._queues.setdefault(key, deque())
+        if len(queue) > self.max_pending:
+            LOG.warning(f'Dropping update {event.update_id} of user {user.id}: {len(queue)} updates in queue')
+            metrics.UPDATES_DROPPED.inc()
+            return UNHANDLED
+
+        callback = event.callback_query
+        turn = Turn(callback is not None and callback.data in self.coalesce)
+        previous = queue[-1] if queue else None
+        queue.append(turn)
+        try:
+            if previous is not None:
+                await asyncio.shield(previous.done)
+            token = _current.set((queue, turn))
+            try:
+                return await handler(event, data)
+            finally:
+                _current.reset(token)
+        finally:
+            queue.remove(turn)
+            if previous is not None and not previous.done.done():
+                # cancelled while waiting, the next update still goes after the previous one
+                previous.done.add_done_callback(lambda _: turn.done.set_result(None))
+            else:
+                turn.done.set_result(None)
+            if not queue:
+                del self._queues[key]
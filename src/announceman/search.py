@@ -0,0 +1,76 @@
+import re
+from bisect import bisect_left
+from difflib import get_close_matches
+from typing import Dict, List, Optional, Set, Tuple
+
+from announceman.route import Route
+
+
+Range = Tuple[Optional[float], Optional[float]]
+NO_RANGE: Range = (None, None)
+FUZZY_CUTOFF = 0.75
+_WORD = re.compile(r'\w+')
+_RANGE = re.compile(r'^(\d+(?:\.\d+)?)?-(\d+(?:\.\d+)?)?(km|m)$')
+_BOUND = re.compile(r'^([<>])(\d+(?:\.\d+)?)(km|m)$')
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def parse_query(query: str) -> Tuple[List[str], Range, Range]:
+    words, ranges = [], {'km': NO_RANGE, 'm': NO_RANGE}
+    for part in query.lower().split():
+        if match := _RANGE.match(part):
+            low, high, unit = match.groups()
+            ranges[unit] = (low and float(low), high and float(high))
+        elif match := _BOUND.match(part):
+            sign, bound, unit = match.groups()
+            ranges[unit] = (None, float(bound)) if sign == '<' else (float(bound), None)
+        else:
+            words.extend(tokenize(part))
+    return words, ranges['km'], ranges['m']
+
+
+def _in_range(value: Optional[float], bounds: Range) -> bool:
+    low, high = bounds
+    if low is None and high is None:
+        return True
+    if value is None:
+        return False
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+class RouteIndex:
+    def __init__(self, routes: List[Route]):
+        self.routes = routes
+        postings: Dict[str, Set[int]] = {}
+        for position, route in enumerate(routes):
+            for token in tokenize(route.name):
+                postings.setdefault(token, set()).add(position)
+        self._vocabulary = sorted(postings)
+        self._postings = postings
+
+    def _match_word(self, word: str) -> Set[int]:
+        matched = set()
+        position = bisect_left(self._vocabulary, word)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(word):
+            matched |= self._postings[self._vocabulary[position]]
+            position += 1
+        if not matched:
+            for token in get_close_matches(word, self._vocabulary, n=3, cutoff=FUZZY_CUTOFF):
+                matched |= self._postings[token]
+        return matched
+
+    def search(self, words: List[str], length_km: Range = NO_RANGE, elevation_m: Range = NO_RANGE) -> List[Route]:
+        positions = set(range(len(self.routes)))
+        for word in words:
+            positions &= self._match_word(word)
+        return [
+            self.routes[position] for position in sorted(positions)
+            if _in_range(self.routes[position].length_km, length_km)
+            and _in_range(self.routes[position].elevation_m, elevation_m)
+        ]
+
+    def find(self, query: str) -> List[Route]:
+        return self.search(*parse_query(query))
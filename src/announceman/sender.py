@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from announceman import config
+
+
+LOG = logging.getLogger(__name__)
+INTERACTIVE = 0
+BULK = 1
+MAX_CHAT_BUCKETS = 10000
+
+_priority: ContextVar[int] = ContextVar('send_priority', default=INTERACTIVE)
+_retries: ContextVar[int] = ContextVar('send_retries', default=0)
+
+
+@contextmanager
+def send_options(priority: int = INTERACTIVE, retries: int = 0):
+    priority_token, retries_token = _priority.set(priority), _retries.set(retries)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _retries.reset(retries_token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+        self.updated = now
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    @property
+    def idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class SendQueue(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = config.SEND_GLOBAL_RATE,
+        private_chat_rate: float = config.SEND_PRIVATE_CHAT_RATE,
+        group_chat_rate: float = config.SEND_GROUP_CHAT_RATE,
+        chat_burst: float = config.SEND_CHAT_BURST,
+        retry_backoff: float = config.SEND_RETRY_BACKOFF,
+        max_retry_after: int = config.SEND_MAX_RETRY_AFTER,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.retry_backoff = retry_backoff
+        self.max_retry_after = max_retry_after
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._dispatcher: asyncio.Task = None
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {key: b for key, b in self._chat_buckets.items() if not b.idle}
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.private_chat_rate if is_private else self.group_chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            _, _, turn = await self._queue.get()
+            if turn.cancelled():
+                continue
+            delay = self.global_bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            turn.set_result(None)
+
+    async def _wait_turn(self, chat_id: Union[int, str], priority: int):
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        turn = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._order), turn))
+        await turn
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> TelegramType:
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        priority, retries = _priority.get(), _retries.get()
+        failures = retry_afters = 0
+        while True:
+            if chat_id is not None:
+                await self._wait_turn(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retry_afters += 1
+                if retry_afters > self.max_retry_after:
+                    raise
+                LOG.warning(f'{type(method).__name__} to {chat_id} throttled, retrying in {e.retry_after}s')
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if failures >= retries:
+                    raise
+                delay = self.retry_backoff * 2 ** failures
+                failures += 1
+                LOG.warning(f'{type(method).__name__} to {chat_id} failed: {e}, retry {failures}/{retries} in {delay}s')
+                await asyncio.sleep(delay)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import sqlite3
+import time
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+dumps = partial(json.dumps, separators=(',', ':'))
+
+
+class RecordStorage(BaseStorage):
+    async def get_state_and_data(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        return await self.get_state(key), await self.get_data(key)
+
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        await self.set_state(key, state)
+        await self.set_data(key, data)
+
+    @abstractmethod
+    async def get_record(self, name: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def set_record(self, name: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        pass
+
+
+class MemoryRecordStorage(MemoryStorage, RecordStorage):
+    def __init__(self):
+        super().__init__()
+        self.records: Dict[str, Any] = {}
+        self._purge_at = 1024
+
+    async def get_record(self, name: str) -> Optional[Dict[str, Any]]:
+        value, expires_at = self.records.get(name, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.records[name]
+            return None
+        return value
+
+    async def set_record(self, name: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self.records[name] = (value, None if ttl is None else now + ttl)
+        if len(self.records) >= self._purge_at:
+            self.records = {
+                key: record for key, record in self.records.items() if record[1] is None or record[1] > now
+            }
+            self._purge_at = max(1024, 2 * len(self.records))
+
+
+class SQLiteStorage(RecordStorage):
+    def __init__(self, path: str, key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        # a single thread owns the connection, keeping the event loop free while sqlite waits on locks
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='sqlite-storage')
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS records (name TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL);
+            CREATE INDEX IF NOT EXISTS records_expires_at ON records (expires_at);
+        """)
+
+    async def _execute(self, sql: str, *params) -> list:
+        def execute():
+            return self._connection.execute(sql, params).fetchall()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, execute)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._execute(
+            'INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET state = excluded.state',
+            self.key_builder.build(key), state.state if isinstance(state, State) else state,
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        rows = await self._execute('SELECT state FROM fsm WHERE key = ?', self.key_builder.build(key))
+        return rows[0][0] if rows else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._execute(
+            'INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET data = excluded.data',
+            self.key_builder.build(key), dumps(data) if data else None,
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        rows = await self._execute('SELECT data FROM fsm WHERE key = ?', self.key_builder.build(key))
+        return json.loads(rows[0][0]) if rows and rows[0][0] else {}
+
+    async def get_state_and_data(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        rows = await self._execute('SELECT state, data FROM fsm WHERE key = ?', self.key_builder.build(key))
+        if not rows:
+            return None, {}
+        state, data = rows[0]
+        return state, json.loads(data) if data else {}
+
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        await self._execute(
+            'INSERT OR REPLACE INTO fsm (key, state, data) VALUES (?, ?, ?)',
+            self.key_builder.build(key), state.state if isinstance(state, State) else state, dumps(data) if data else None,
+        )
+
+    async def get_record(self, name: str) -> Optional[Dict[str, Any]]:
+        rows = await self._execute(
+            'SELECT value FROM records WHERE name = ? AND (expires_at IS NULL OR expires_at > ?)', name, time.time(),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def set_record(self, name: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        now = time.time()
+        await self._execute(
+            'INSERT OR REPLACE INTO records (name, value, expires_at) VALUES (?, ?, ?)',
+            name, dumps(value), None if ttl is None else now + ttl,
+        )
+        await self._execute('DELETE FROM records WHERE expires_at <= ?', now)
+
+    async def close(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._connection.close)
+        self._executor.shutdown()
+
+
+def create_storage(url: str) -> RecordStorage:
+    scheme, _, location = url.partition('://')
+    if scheme == 'memory':
+        return MemoryRecordStorage()
+    if scheme == 'sqlite':
+        return SQLiteStorage(location.removeprefix('/'))
+    if scheme in ('redis', 'rediss', 'unix'):
+        from announceman.storage_redis import RedisRecordStorage
+        return RedisRecordStorage.from_url(url, json_dumps=dumps)
+    raise ValueError(f'Unsupported storage url: {url}')
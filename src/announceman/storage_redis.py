@@ -0,0 +1,39 @@
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+from announceman.storage import RecordStorage, dumps
+
+
+class RedisRecordStorage(RedisStorage, RecordStorage):
+    def _record_key(self, name: str) -> str:
+        return f'announceman:record:{name}'
+
+    async def get_state_and_data(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        state, data = await self.redis.mget(self.key_builder.build(key, 'state'), self.key_builder.build(key, 'data'))
+        if isinstance(state, bytes):
+            state = state.decode('utf-8')
+        return state, self.json_loads(data) if data is not None else {}
+
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        state_key, data_key = self.key_builder.build(key, 'state'), self.key_builder.build(key, 'data')
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if state is None:
+                pipe.delete(state_key)
+            else:
+                pipe.set(state_key, state.state if isinstance(state, State) else state, ex=self.state_ttl)
+            if data:
+                pipe.set(data_key, self.json_dumps(data), ex=self.data_ttl)
+            else:
+                pipe.delete(data_key)
+            await pipe.execute()
+
+    async def get_record(self, name: str) -> Optional[Dict[str, Any]]:
+        value = await self.redis.get(self._record_key(name))
+        return None if value is None else json.loads(value)
+
+    async def set_record(self, name: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        await self.redis.set(self._record_key(name), dumps(value), px=None if ttl is None else int(ttl * 1000))
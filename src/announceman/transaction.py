@@ -0,0 +1,94 @@
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+from aiogram.types import TelegramObject
+
+from announceman.storage import RecordStorage
+
+
+LOG = logging.getLogger(__name__)
+
+
+class StateTransaction:
+    def __init__(self, context: FSMContext):
+        self.context = context
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.round_trips = 0
+        self._loaded: Optional[Tuple[Optional[str], Dict[str, Any]]] = None
+
+    @property
+    def stack(self) -> List[Tuple[str, str]]:
+        return self.data.setdefault('stack', [])
+
+    def set_state(self, state: StateType):
+        self.state = state.state if isinstance(state, State) else state
+
+    def update_data(self, **kwargs):
+        self.data.update(kwargs)
+
+    def clear(self):
+        self.state = None
+        self.data = {}
+
+    async def load(self):
+        storage, key = self.context.storage, self.context.key
+        if isinstance(storage, RecordStorage):
+            self.state, self.data = await storage.get_state_and_data(key)
+            self.round_trips += 1
+        else:
+            self.state, self.data = await storage.get_state(key), await storage.get_data(key)
+            self.round_trips += 2
+        self._loaded = (self.state, copy.deepcopy(self.data))
+
+    async def commit(self):
+        if self._loaded == (self.state, self.data):
+            return
+        storage, key = self.context.storage, self.context.key
+        if isinstance(storage, RecordStorage):
+            await storage.set_state_and_data(key, self.state, self.data)
+            self.round_trips += 1
+        else:
+            await storage.set_state(key, self.state)
+            await storage.set_data(key, self.data)
+            self.round_trips += 2
+        self._loaded = (self.state, copy.deepcopy(self.data))
+
+    async def __aenter__(self) -> "StateTransaction":
+        await self.load()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.commit()
+        LOG.debug(f'State transaction for {self.context.key.user_id}: {self.round_trips} storage round-trips')
+
+
+# replaces aiogram's FSMContextMiddleware, which reads the state on every update before handlers
+# load it again: here state and data are loaded once, handed over as `tx` (and `raw_state` for
+# state filters) and committed after the handler. Updates of one user are serialized by the scheduler
+class TransactionMiddleware(BaseMiddleware):
+    def __init__(self, fsm: FSMContextMiddleware):
+        self.fsm = fsm
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        data['fsm_storage'] = self.fsm.storage
+        context = self.fsm.resolve_event_context(data['bot'], data)
+        # inline queries have no chat and no conversation state
+        if context is None or data.get('event_chat') is None:
+            return await handler(event, data)
+
+        async with StateTransaction(context) as tx:
+            data.update(state=context, raw_state=tx.state, tx=tx)
+            return await handler(event, data)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import mmap
+from typing import Awaitable, Callable, Dict, List, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from announceman import metrics
+from announceman.preview_cache import FileIdStore
+from announceman.replies import InMemoryInputFile, photo_file_id
+from announceman.sender import BULK, send_options
+from announceman.route import Route
+
+
+LOG = logging.getLogger(__name__)
+
+
+def open_preview(route: Route) -> InMemoryInputFile:
+    if route.preview_image is not None:
+        return InMemoryInputFile(route.preview_image)
+    with open(route.preview_path, 'rb') as f:
+        return InMemoryInputFile(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class PreviewUploads:
+    def __init__(self, file_ids: FileIdStore):
+        self.file_ids = file_ids
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._files: Dict[str, InMemoryInputFile] = {}
+
+    def preview_file(self, route: Route) -> InMemoryInputFile:
+        if route.cache_key not in self._files:
+            self._files[route.cache_key] = open_preview(route)
+        return self._files[route.cache_key]
+
+    async def send(self, route: Route, send: Callable[[Union[InMemoryInputFile, str]], Awaitable[str]]) -> str:
+        if route.preview_id is None:
+            async with self._locks.setdefault(route.cache_key, asyncio.Lock()):
+                if route.preview_id is None:
+                    metrics.FILE_IDS.inc(result='miss')
+                    LOG.info(f'Uploading preview of {route.name}')
+                    self.remember(route, await send(self.preview_file(route)))
+                    return route.preview_id
+        metrics.FILE_IDS.inc(result='hit')
+        return await send(route.preview_id)
+
+    def remember(self, route: Route, preview_id: str):
+        route.preview_id = preview_id
+        route.preview_image = None
+        try:
+            self.file_ids.set(route.cache_key, preview_id)
+        except OSError:
+            # the preview is sent already, it is only uploaded again after a restart
+            LOG.exception(f'Failed to save file_id of {route.name}')
+        self._locks.pop(route.cache_key, None)
+        self._files.pop(route.cache_key, None)
+
+    # routes are read again before every upload, so routes added by a reload are pre-warmed as well
+    async def prewarm(self, bot: Bot, chat_id: Union[int, str], routes: Callable[[], List[Route]], interval: float):
+        LOG.info(f'Pre-warming previews in {chat_id}')
+
+        async def send(route_preview: Union[InMemoryInputFile, str]) -> str:
+            message = await bot.send_photo(chat_id=chat_id, photo=route_preview)
+            return photo_file_id(message)
+
+        attempted = set()
+        while True:
+            route = next((route for route in routes()
+                          if route.preview_id is None and route.cache_key not in attempted), None)
+            if route is None:
+                break
+            attempted.add(route.cache_key)
+            try:
+                with send_options(priority=BULK):
+                    await self.send(route, send)
+            except TelegramRetryAfter as e:
+                LOG.warning(f'Pre-warming throttled for {e.retry_after}s')
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                LOG.exception(f'Failed to pre-warm preview of {route.name}')
+            await asyncio.sleep(interval)
+        LOG.info(f'Pre-warming finished, tried {len(attempted)} previews')